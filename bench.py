@@ -0,0 +1,290 @@
+import os
+
+# Never drive a real panel from the benchmark, and don't wait on fake refreshes
+os.environ["CREATEDAT_HARDWARE"] = "sim"
+os.environ.setdefault("CREATEDAT_SIM_TIME_SCALE", "0")
+
+import argparse
+import hashlib
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+logger = logging.getLogger("bench")
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench")
+GOLDEN_PATH = os.path.join(BENCH_DIR, "golden.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# Sweep: every hash_mode, these block sizes, with and without the Perlin stage
+HASH_MODES = range(11)
+BLOCK_SIZES = (1, 2, 3, 5, 10)
+TIMESTAMPS = (1735689600.123456, 1767225599.5)
+# (ns, nsX, nsY) as render.make_seeds gives them for PRESS_LOCATIONS
+NOISE_SEEDS = (
+    (0.04599999999999795, 0.07300000000000025, 0.07299999999999897),
+    (0.05413321000000138, 0.07456779999999973, 0.079565410000001),
+)
+# gps.DEFAULT_LATITUDE/LONGITUDE and the museum; their seeds give hash_mode 6 and 4
+PRESS_LOCATIONS = ((35.7, 139.7), (35.717420, 139.772949))
+# Press durations whose block sizes are all in BLOCK_SIZES, with and without Perlin
+PRESS_DURATIONS = (0.6, 1.3, 2.2, 3.5, 5.0)
+
+# A stage fails the gate when its median is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.25
+# ... and by more than this many seconds, so sub-millisecond noise can't fail it
+MIN_REGRESSION_S = 0.002
+
+
+def _digest(data):
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+def _cases():
+    for hash_mode in HASH_MODES:
+        for block_size in BLOCK_SIZES:
+            for t, (ns, nsX, nsY) in zip(TIMESTAMPS, NOISE_SEEDS):
+                for is_perlin in (False, True):
+                    yield hash_mode, block_size, is_perlin, t, ns, nsX, nsY
+
+
+def _case_name(hash_mode, block_size, is_perlin, t, *_):
+    return f"h{hash_mode}-b{block_size}-{'perlin' if is_perlin else 'plain'}-t{t}"
+
+
+def _test_image(width, height):
+    from PIL import Image, ImageDraw
+
+    image = Image.new("1", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 40):
+        draw.line((i, 0, width - i, height), fill=0, width=3)
+    draw.ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), outline=0, width=9)
+    draw.rectangle((10, 10, 130, 70), fill=0)
+    return image
+
+
+class Stages:
+    def __init__(self, measure_memory=False):
+        """
+        Per-stage timings (and peak traced memory) collected over a run.
+
+        :param measure_memory: trace allocations; slows everything down, so
+            timings from such a run aren't comparable
+        """
+        self.measure_memory = measure_memory
+        self.times = {}
+        self.peaks = {}
+
+    def run(self, name, fn, *args):
+        if self.measure_memory:
+            tracemalloc.reset_peak()
+            start_mem = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+
+        if self.measure_memory:
+            peak = tracemalloc.get_traced_memory()[1] - start_mem
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        else:
+            self.times.setdefault(name, []).append(elapsed)
+        return result
+
+
+def run_sweep(stages, epd, image):
+    """Run every case through the pipeline; returns {case or stage: sha256}."""
+    from lib import epdconfig
+
+    digests = {}
+    for case in _cases():
+        hash_mode, block_size, is_perlin, t, ns, nsX, nsY = case
+        bw = stages.run("generatebuffer_time", epd.generatebuffer_time, hash_mode, block_size, t)
+        if is_perlin:
+            bw = stages.run("generatebuffer_perlin", epd.generatebuffer_perlin, bw, ns, nsX, nsY)
+        digests[_case_name(*case)] = _digest(bw)
+
+    black = stages.run("getbuffer", epd.getbuffer, image)
+    digests["getbuffer"] = _digest(black)
+
+    stages.run("display", epd.display, black, epd.const_frame(0x00))
+    sent = epdconfig.implementation.last_data
+    digests["display:0x10"] = _digest(sent[0x10])
+    digests["display:0x13"] = _digest(sent[0x13])
+
+    return digests
+
+
+def summarize(stages):
+    summary = {}
+    for name, times in stages.times.items():
+        summary[name] = {
+            "calls": len(times),
+            "median_s": statistics.median(times),
+            "mean_s": statistics.fmean(times),
+            "max_s": max(times),
+            "total_s": sum(times),
+        }
+    for name, peak in stages.peaks.items():
+        summary.setdefault(name, {})["peak_bytes"] = peak
+    return summary
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def check_golden(digests, golden):
+    """Names of frames whose digest differs from (or is missing in) the golden corpus."""
+    return sorted(
+        name for name in set(digests) | set(golden)
+        if digests.get(name) != golden.get(name)
+    )
+
+
+def check_previews(epd, digests):
+    """
+    Presses rendered the way render_batch previews them that differ from the
+    frame the device draws: the hash_mode 0 sweep case with the same seeds.
+    """
+    import render
+    import render_batch
+
+    mismatches = []
+    for t, (lat, lon) in zip(TIMESTAMPS, PRESS_LOCATIONS):
+        _, _, ns, nsX, nsY = render.make_seeds(lat, lon)
+        for duration in PRESS_DURATIONS:
+            bw, _ = render_batch.render_press(epd, lat, lon, duration, t)
+            case = (0, render.block_size_for(duration), render.is_tenths_even(duration), t, ns, nsX, nsY)
+            if _digest(bw) != digests.get(_case_name(*case)):
+                mismatches.append(f"lat{lat}-lon{lon}-d{duration}-t{t}")
+    return mismatches
+
+
+def check_baseline(summary, baseline, threshold):
+    """Stages whose median regressed beyond `threshold` versus the baseline."""
+    regressions = []
+    for name, stats in summary.items():
+        base = baseline.get("stages", {}).get(name)
+        if not base or "median_s" not in stats:
+            continue
+        limit = base["median_s"] * (1 + threshold)
+        if stats["median_s"] > limit and stats["median_s"] - base["median_s"] > MIN_REGRESSION_S:
+            regressions.append((name, base["median_s"], stats["median_s"]))
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Render pipeline benchmark and golden-frame check")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the sweep")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of a stage median versus the baseline (0.25 = 25%%)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--update-golden", action="store_true", help="store the frame digests as the golden corpus")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run's timings as the baseline")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH")
+    args = parser.parse_args()
+
+    from lib.epd7in5b_V2 import EPD
+
+    epd = EPD()
+    image = _test_image(epd.width, epd.height)
+
+    # Warm-up pass: imports, caches, and the reference digests
+    digests = run_sweep(Stages(), epd, image)
+
+    stages = Stages()
+    for _ in range(args.repeat):
+        if run_sweep(stages, epd, image) != digests:
+            logger.error("frames differ between passes: output is not deterministic")
+            return 1
+
+    if not args.no_memory:
+        memory = Stages(measure_memory=True)
+        tracemalloc.start()
+        try:
+            run_sweep(memory, epd, image)
+        finally:
+            tracemalloc.stop()
+        stages.peaks = memory.peaks
+
+    summary = summarize(stages)
+    for name, stats in summary.items():
+        peak = stats.get("peak_bytes")
+        peak = f"{peak / 1024:9.0f} KiB peak" if peak is not None else ""
+        logger.info(
+            f"{name:<22} {stats['calls']:5d} calls  median {stats['median_s'] * 1000:8.2f} ms  "
+            f"max {stats['max_s'] * 1000:8.2f} ms  {peak}"
+        )
+
+    results = {
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "stages": summary,
+        "digests": digests,
+    }
+    if args.json:
+        _save(args.json, results)
+
+    failed = False
+
+    if args.update_golden:
+        _save(GOLDEN_PATH, digests)
+        logger.info(f"golden corpus updated ({len(digests)} frames)")
+    else:
+        golden = _load(GOLDEN_PATH)
+        if golden is None:
+            logger.warning(f"no golden corpus at {GOLDEN_PATH}; run with --update-golden")
+        else:
+            changed = check_golden(digests, golden)
+            if changed:
+                failed = True
+                logger.error(f"{len(changed)} frames differ from the golden corpus: {', '.join(changed[:10])}")
+            else:
+                logger.info(f"all {len(golden)} frames match the golden corpus")
+
+    mismatches = check_previews(epd, digests)
+    if mismatches:
+        failed = True
+        logger.error(f"{len(mismatches)} render_batch previews differ from the device frame: {', '.join(mismatches)}")
+    else:
+        logger.info("render_batch previews match the device frames")
+
+    if args.update_baseline:
+        _save(BASELINE_PATH, {"machine": results["machine"], "python": results["python"], "stages": summary})
+        logger.info("baseline updated")
+    else:
+        baseline = _load(BASELINE_PATH)
+        if baseline is None:
+            logger.warning(f"no baseline at {BASELINE_PATH}; run with --update-baseline on the target machine")
+        else:
+            if baseline.get("machine") != results["machine"]:
+                logger.warning(f"baseline was recorded on {baseline.get('machine')}")
+            for name, before, after in check_baseline(summary, baseline, args.threshold):
+                failed = True
+                logger.error(f"{name} regressed: median {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
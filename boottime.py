@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("boot")
+
+# Reference point: when this module was first imported (top of main.py)
+_T0 = time.monotonic()
+_T0_WALL = time.time()
+
+_marks = []
+_lock = threading.Lock()
+# Marks come from several threads; one writer at a time owns the .tmp file
+_write_lock = threading.Lock()
+_profile_path = None
+
+
+def process_age():
+    """Seconds since the kernel started this process, or None if unknown."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# Interpreter start-up before main.py got to run
+_AGE_AT_T0 = process_age()
+
+
+def enable_profile(path):
+    """Write the timeline to `path` (JSON), and again after every later mark."""
+    global _profile_path
+
+    _profile_path = path
+    logger.info(f"boot profiling enabled, timeline -> {path}")
+    write_timeline(path)
+
+
+def mark(phase):
+    """
+    Record that `phase` has just finished. Only the first occurrence of each
+    phase is kept, so call sites on recurring paths mark just the first one.
+    """
+    at = time.monotonic() - _T0
+    with _lock:
+        if any(m["phase"] == phase for m in _marks):
+            return
+        _marks.append({
+            "phase": phase,
+            "at": round(at, 4),
+            "thread": threading.current_thread().name,
+        })
+
+    if _profile_path is not None:
+        logger.info(f"{phase} at {at:.2f}s")
+        write_timeline(_profile_path)
+
+
+def timeline():
+    """
+    Recorded phases in order. "delta" is the time since the previous mark on
+    the same thread (since start-up for the main thread); None for the first
+    mark of any other thread, whose start isn't known.
+    """
+    with _lock:
+        marks = [dict(m) for m in _marks]
+
+    prev = {threading.main_thread().name: 0.0}
+    for m in marks:
+        last = prev.get(m["thread"])
+        m["delta"] = None if last is None else round(m["at"] - last, 4)
+        prev[m["thread"]] = m["at"]
+
+    return {
+        "started": _T0_WALL,
+        "process_age_at_start": _AGE_AT_T0,
+        "phases": marks,
+    }
+
+
+def write_timeline(path):
+    tmp = path + ".tmp"
+    with _write_lock:
+        try:
+            with open(tmp, "w") as f:
+                json.dump(timeline(), f, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"could not write boot timeline: {e}")
+
+
+def summary():
+    """Log how long each recorded phase took and the total so far."""
+    for m in timeline()["phases"]:
+        delta = "     -" if m["delta"] is None else f"{m['delta']:6.2f}"
+        logger.info(f"{m['phase']:<20} {delta}s  (at {m['at']:6.2f}s, {m['thread']})")
+
+    total = time.monotonic() - _T0
+    age = process_age()
+    if age is None:
+        logger.info(f"startup took {total:.2f}s")
+    else:
+        # The difference is interpreter start-up before main.py ran
+        logger.info(f"startup took {total:.2f}s ({age:.2f}s since process start)")
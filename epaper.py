@@ -1,18 +1,83 @@
 import logging
+import os
 import threading
-import queue
 import time
-from PIL import Image
 
 from lib import epd7in5b_V2
-from spi import spi_lock, epaper_busy 
+from spi import spi_lock, epaper_busy, panel_refreshing
+import render
+import render_pool
+import boottime
 
 logger = logging.getLogger("epaper")
 
+# Packed frames are also written here when set, so they survive a restart
+RENDER_CACHE_DIR = None
+RENDER_CACHE_SIZE = 32
+
+# DRAW params have never carried make_seeds()' hash_mode: the device always renders hash_mode 0
+RENDER_HASH_MODE = 0
+
+# Block sizes the pre-renderer prepares (for both is_perlin values) while IDLE
+PRERENDER_BLOCK_SIZES = (1, 2, 3)
+
+# Partial updates: force a full refresh after this many partials (ghosting),
+# or when the dirty area / number of regions gets too large to be worth it
+PARTIAL_FULL_EVERY = 5
+PARTIAL_MAX_AREA = 0.5
+PARTIAL_MAX_RECTS = 2
+
+# Panel states. After the first full init since the process started the panel
+# is "warm" and is brought back with the faster EPD.init_Fast, also out of deep
+# sleep: init_Fast hardware-resets and reprograms the controller, so this is
+# intentional and only the first wake pays for the full EPD.init.
+PANEL_COLD = "cold"
+PANEL_AWAKE = "awake"
+PANEL_FAST = "fast-ready"
+PANEL_PARTIAL = "partial"
+PANEL_SLEEPING = "sleeping"
+
+# Seconds without panel activity before it is put into deep sleep (None: never)
+PANEL_SLEEP_AFTER = 300
+
 _epd = None
-_task_q = queue.Queue()
 _worker_started = False
 _init_lock = threading.Lock()
+# Serializes whole panel operations (init/clear/draw); the SPI bus itself is
+# only locked per transfer inside the driver
+_panel_lock = threading.RLock()
+_cache = render.RenderCache(max_entries=RENDER_CACHE_SIZE, cache_dir=RENDER_CACHE_DIR)
+
+_prerender_lock = threading.Condition()
+_prerender_job = None
+_prerender_started = False
+_draw_pending = threading.Event()
+
+# Render scheduler: a single slot holding the latest request. A new request
+# replaces the pending one and makes an in-progress render stop at its next stage.
+_sched = threading.Condition()
+_pending = None
+_generation = 0
+_running = None
+_queue_stats = {
+    "submitted": 0,
+    "coalesced": 0,
+    "cancelled": 0,
+    "completed": 0,
+    "last_wait": 0.0,
+    "max_wait": 0.0,
+}
+_pool = None
+
+# Last black frame on the panel (pre-inversion, as produced by the renderer)
+_last_frame = None
+_partial_count = 0
+
+_panel_state = PANEL_COLD
+_panel_warm = False
+_panel_last_used = 0.0
+_sleep_timer = None
+_timings = {}
 
 def init():
     global _epd, _worker_started
@@ -21,19 +86,21 @@ def init():
         if _epd is None:
             logger.info("init start")
             epaper_busy.set()
-            time.sleep(0.1)
 
             try:
-                with spi_lock:
-                    _epd = epd7in5b_V2.EPD()
-                    _epd.init()
+                with _panel_lock:
+                    epd = epd7in5b_V2.EPD()
+                    epd.spi_lock = spi_lock
+                    epd.refreshing = panel_refreshing
+                    _enter_state(epd, PANEL_AWAKE)
+                    _epd = epd
+                    _touch()
+                boottime.mark("epaper.init")
                 logger.info("epd initialized")
             except Exception as e:
                 logger.error(f"{e}", exc_info=True)
-                epaper_busy.clear()
                 raise
             finally:
-                time.sleep(0.1)
                 epaper_busy.clear()
 
         if not _worker_started:
@@ -44,73 +111,444 @@ def init():
     return _epd
 
 
-def clear():
+def start_render_pool(processes=None):
+    """
+    Fork the Perlin render workers. Call this before any other thread starts;
+    draws fall back to in-process rendering when there is no pool.
+    """
+    global _pool
+
+    if _pool is None:
+        _pool = render_pool.PerlinPool(processes)
+        _pool.start()
+    return _pool
+
+
+def preload():
+    """
+    Import the render stack (numpy, Perlin engine) here and in the pool
+    workers. Meant to run in the background once the system is up, so the
+    first press doesn't pay for it and boot doesn't either.
+    """
+    start = time.monotonic()
+    import numpy
+    from lib import perlin
+    if _pool is not None:
+        _pool.preload()
+    logger.info(f"render stack preloaded in {time.monotonic() - start:.2f}s")
+
+
+def clear(wait=True):
+    """
+    Queue a CLEAR behind (or in place of) any pending DRAW. With wait=True
+    this returns once the panel has been cleared or the request was superseded.
+    """
+    logger.info("clear requested")
+    init()
+    done = _submit("CLEAR", {})
+    if wait:
+        done.wait()
+    return done
+
+
+def queue_stats():
+    """
+    Scheduler metrics: queue depth, coalesced/cancelled counts, wait times (s),
+    and whether the panel is refreshing (waiting on BUSY) right now.
+    """
+    with _sched:
+        stats = dict(_queue_stats)
+        stats["depth"] = (_pending is not None) + (_running is not None)
+    stats["refreshing"] = panel_refreshing.is_set()
+    return stats
+
+
+def _submit(task, params):
+    global _pending, _generation
+
+    done = threading.Event()
+    with _sched:
+        if _pending is not None:
+            _queue_stats["coalesced"] += 1
+            logger.info(f"pending {_pending[0]} superseded by {task}")
+            _pending[3].set()
+        _generation += 1
+        _pending = (task, params, time.monotonic(), done, _generation)
+        _queue_stats["submitted"] += 1
+        _draw_pending.set()
+        _sched.notify()
+    return done
+
+
+def _superseded(generation):
+    return generation != _generation
+
+
+def _clear_panel(epd):
     logger.info("clear display")
-    epd = init()
+    with _panel_lock:
+        epaper_busy.set()
+        try:
+            _ready_full(epd)
+            _timed("clear", epd.Clear)
+            _remember_frame(epd.const_frame(0x00), partial=False)
+            boottime.mark("first Clear")
+        finally:
+            _touch()
+            epaper_busy.clear()
+
+
+def panel_state():
+    return _panel_state
 
-    epaper_busy.set()
-    time.sleep(0.1)
 
+def panel_timings():
+    """Per-step timing stats: {name: {"count", "last", "total"}} in seconds."""
+    with _panel_lock:
+        return {name: dict(t) for name, t in _timings.items()}
+
+
+def _record_timing(name, seconds):
+    t = _timings.setdefault(name, {"count": 0, "last": 0.0, "total": 0.0})
+    t["count"] += 1
+    t["last"] = seconds
+    t["total"] += seconds
+    logger.info(f"{name} took {seconds:.2f}s")
+
+
+def _timed(name, fn, *args):
+    start = time.monotonic()
     try:
-        with spi_lock:
-            epd.Clear()
+        return fn(*args)
     finally:
-        time.sleep(0.1)
-        epaper_busy.clear()
+        _record_timing(name, time.monotonic() - start)
 
 
-def draw_async(block_size=10, hash_mode=0, is_perlin=False, ns=0.01, nsX=0.01, nsY=0.01):
-    logger.info("draw_async requested")
-    init()
-    params = {
+def _enter_state(epd, state):
+    global _panel_state, _panel_warm, _last_frame, _partial_count
+
+    if _panel_state == state:
+        return
+
+    steps = {
+        PANEL_AWAKE: epd.init,
+        PANEL_FAST: epd.init_Fast,
+        PANEL_PARTIAL: epd.init_part,
+        PANEL_SLEEPING: epd.sleep,
+    }
+    _timed(f"{_panel_state} -> {state}", steps[state])
+
+    if state == PANEL_AWAKE:
+        _panel_warm = True
+    if state == PANEL_SLEEPING:
+        # Panel RAM is lost; the first draw after waking has no frame to diff against
+        _last_frame = None
+        _partial_count = 0
+    else:
+        # Every init resets the controller, so display_Partial has to write the
+        # old-data (0x10) plane again before its first refresh
+        epd.partFlag = 1
+    _panel_state = state
+
+
+def _ready_full(epd):
+    # Get the panel ready for a full-frame display/Clear
+    if _panel_state in (PANEL_AWAKE, PANEL_FAST):
+        return
+    _enter_state(epd, PANEL_FAST if _panel_warm else PANEL_AWAKE)
+
+
+def _touch():
+    # Mark panel activity and restart the idle countdown to deep sleep
+    global _panel_last_used, _sleep_timer
+
+    _panel_last_used = time.monotonic()
+    if PANEL_SLEEP_AFTER is None:
+        return
+    if _sleep_timer is not None:
+        _sleep_timer.cancel()
+    _sleep_timer = threading.Timer(PANEL_SLEEP_AFTER, _sleep_if_idle)
+    _sleep_timer.daemon = True
+    _sleep_timer.start()
+
+
+def _sleep_if_idle():
+    with _panel_lock:
+        if _epd is None or _panel_state in (PANEL_COLD, PANEL_SLEEPING):
+            return
+        if time.monotonic() - _panel_last_used < PANEL_SLEEP_AFTER:
+            return
+
+        logger.info("panel idle, going to sleep")
+        epaper_busy.set()
+        try:
+            _enter_state(_epd, PANEL_SLEEPING)
+        except Exception as e:
+            logger.warning(f"panel sleep failed: {e}")
+        finally:
+            epaper_busy.clear()
+
+
+def dirty_rects(old, new, width, height, gap=8):
+    """
+    Byte-aligned rectangles (x0, y0, x1, y1) covering every byte that differs
+    between two packed 1-bpp frames. Changed rows closer than `gap` rows are
+    merged into one rectangle.
+    """
+    import numpy as np
+
+    row_bytes = (width + 7) // 8
+    a = np.frombuffer(bytes(old), dtype=np.uint8).reshape(height, row_bytes)
+    b = np.frombuffer(bytes(new), dtype=np.uint8).reshape(height, row_bytes)
+    changed = a != b
+
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return []
+
+    rects = []
+    for band in np.split(rows, np.flatnonzero(np.diff(rows) > gap) + 1):
+        y0, y1 = int(band[0]), int(band[-1]) + 1
+        cols = np.flatnonzero(changed[y0:y1].any(axis=0))
+        rects.append((int(cols[0]) * 8, y0, (int(cols[-1]) + 1) * 8, y1))
+    return rects
+
+
+def _remember_frame(bw, partial):
+    global _last_frame, _partial_count
+
+    _last_frame = bytes(bw)
+    _partial_count = _partial_count + 1 if partial else 0
+
+
+def _plan_partial(epd, bw):
+    # Regions to send for a partial update, or None when a full refresh is due
+    if _last_frame is None or _partial_count >= PARTIAL_FULL_EVERY:
+        return None
+
+    rects = dirty_rects(_last_frame, bw, epd.width, epd.height)
+    if len(rects) > PARTIAL_MAX_RECTS:
+        rects = [(
+            min(r[0] for r in rects), min(r[1] for r in rects),
+            max(r[2] for r in rects), max(r[3] for r in rects),
+        )]
+
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rects)
+    if area > PARTIAL_MAX_AREA * epd.width * epd.height:
+        return None
+    return rects
+
+
+def _show(epd, bw, red, partial=False):
+    rects = _plan_partial(epd, bw) if partial else None
+
+    if rects is None:
+        _ready_full(epd)
+        _timed("display", epd.display, bw, red)
+        _remember_frame(bw, partial=False)
+        return
+
+    if not rects:
+        logger.info("frame unchanged, nothing to send")
+        return
+
+    import numpy as np
+
+    _enter_state(epd, PANEL_PARTIAL)
+    row_bytes = (epd.width + 7) // 8
+    frame = np.frombuffer(bytes(bw), dtype=np.uint8).reshape(epd.height, row_bytes)
+    for x0, y0, x1, y1 in rects:
+        logger.info(f"partial update {x0},{y0} - {x1},{y1}")
+        region = frame[y0:y1, x0 // 8:x1 // 8].tobytes()
+        _timed("display_partial", epd.display_Partial, region, x0, y0, x1, y1)
+    _remember_frame(bw, partial=True)
+
+
+def make_params(block_size, is_perlin, ns, nsX, nsY, t):
+    """DRAW params for render_frame; t=None renders at the current time."""
+    return {
         "block_size": block_size,
         "is_perlin": is_perlin,
         "ns": ns,
         "nsX": nsX,
-        "nsY": nsY
+        "nsY": nsY,
+        "t": t
     }
-    _task_q.put(("DRAW", params))
 
 
-def _worker():
-    logger.info("worker running")
+def draw_async(block_size=10, hash_mode=0, is_perlin=False, ns=0.01, nsX=0.01, nsY=0.01, t=None, partial=False):
+    """
+    Queue a DRAW. With partial=True only the regions that differ from the
+    frame currently on the panel are refreshed, when the partial policy allows.
+    hash_mode is accepted but not used; frames use RENDER_HASH_MODE.
+    """
+    logger.info("draw_async requested")
+    init()
+    params = make_params(block_size, is_perlin, ns, nsX, nsY, t)
+    params["partial"] = partial
+    return _submit("DRAW", params)
+
+
+def prerender(ns=0.01, nsX=0.01, nsY=0.01, t=None):
+    """
+    Speculatively render the frames a DRAW with these seeds is likely to ask for.
+
+    Frames land in the render cache; nothing is sent to the panel. A newer
+    call replaces the pending job, and any DRAW makes the pre-renderer stop.
+    """
+    global _prerender_job, _prerender_started
+
+    if t is None:
+        t = time.time()
+
+    jobs = [
+        make_params(block_size, is_perlin, ns, nsX, nsY, t)
+        for block_size in PRERENDER_BLOCK_SIZES
+        for is_perlin in (False, True)
+    ]
+
+    with _prerender_lock:
+        _prerender_job = jobs
+        if not _prerender_started:
+            threading.Thread(target=_prerender_worker, daemon=True).start()
+            _prerender_started = True
+        _prerender_lock.notify()
+
+
+def _prerender_worker():
+    global _prerender_job
+
+    logger.info("prerender worker running")
+
+    # Render work here is optional; let the draw worker, LED and GPS threads go first
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"prerender priority not lowered: {e}")
 
     while True:
-        task, params = _task_q.get()
+        with _prerender_lock:
+            while _prerender_job is None:
+                _prerender_lock.wait()
+            jobs = _prerender_job
+            _prerender_job = None
 
-        if task == "DRAW":
-            logger.info("buffer generation start")
+        # A DRAW or a newer job stops the current frame at its next stage
+        superseded = lambda: _draw_pending.is_set() or _prerender_job is not None
 
-            block_size = params.get("block_size", 10)
-            hash_mode = params.get("hash_mode", 0)
-            is_perlin = params.get("is_perlin", False)
-            ns = params.get("ns", 0.01)
-            nsX = params.get("nsX", 0.01)
-            nsY = params.get("nsY", 0.01)
+        for params in jobs:
+            if superseded():
+                logger.debug("prerender yielded")
+                break
 
             epd = _epd
-            blank = Image.new("1", (epd.width, epd.height), 255)
+            if epd is None:
+                break
 
-            bw = epd.generatebuffer_time(hash_mode, block_size)
-            if is_perlin:
-                bw = epd.generatebuffer_perlin(bw, ns, nsX, nsY)
-            red = epd.getbuffer(blank)
+            try:
+                # In-process on purpose: the pool is kept free for real draws
+                render_frame(epd, params, cancelled=superseded)
+            except render.RenderCancelled:
+                logger.debug("prerender yielded mid-frame")
+                break
+            except Exception as e:
+                logger.warning(f"prerender failed: {e}")
+                break
+
+
+def render_frame(epd, params, pool=None, cancelled=None, cache=_cache):
+    """
+    The black frame the panel shows for `params` (from make_params).
+
+    Goes through the shared render cache unless `cache` is None.
+    """
+    t = params.get("t")
+    if t is None:
+        t = time.time()
+
+    return render.render_black(
+            epd,
+            RENDER_HASH_MODE,
+            params.get("block_size", 10),
+            params.get("is_perlin", False),
+            params.get("ns", 0.01),
+            params.get("nsX", 0.01),
+            params.get("nsY", 0.01),
+            t,
+            cache=cache,
+            pool=pool,
+            cancelled=cancelled
+    )
+
+
+def _draw(epd, params, generation):
+    logger.info("buffer generation start")
 
-            logger.info("buffer generation done")
+    cancelled = lambda: _superseded(generation)
 
+    start = time.monotonic()
+    try:
+        bw = render_frame(epd, params, pool=_pool, cancelled=cancelled)
+    finally:
+        with _sched:
+            if _pending is None:
+                _draw_pending.clear()
+    red = epd.const_frame(0x00)
+
+    with _panel_lock:
+        _record_timing("render", time.monotonic() - start)
+    logger.info("buffer generation done")
+
+    # Last chance to drop the frame before the slow part starts
+    if cancelled():
+        raise render.RenderCancelled()
+
+    try:
+        with _panel_lock:
             epaper_busy.set()
-            
-            time.sleep(0.1)
+            logger.info("draw start")
+            _show(epd, bw, red, params.get("partial", False))
+            logger.info("draw done")
+    finally:
+        _touch()
+        epaper_busy.clear()
 
-            try:
-                with spi_lock:
-                    logger.info("draw start")
-                    epd.display(bw, red)
-                    logger.info("draw done")
-            except Exception as e:
-                logger.error(f"Draw failed: {e}", exc_info=True)
-            finally:
-                time.sleep(0.1)
-                epaper_busy.clear()
 
-        _task_q.task_done()
+def _worker():
+    global _pending, _running
+
+    logger.info("worker running")
+
+    while True:
+        with _sched:
+            while _pending is None:
+                _sched.wait()
+            task, params, queued_at, done, generation = _pending
+            _pending = None
+            _running = task
+
+            waited = time.monotonic() - queued_at
+            _queue_stats["last_wait"] = waited
+            _queue_stats["max_wait"] = max(_queue_stats["max_wait"], waited)
+            if task != "DRAW":
+                _draw_pending.clear()
+
+        logger.info(f"{task} start (waited {waited:.2f}s)")
+
+        try:
+            if task == "DRAW":
+                _draw(_epd, params, generation)
+            elif task == "CLEAR":
+                _clear_panel(_epd)
+            with _sched:
+                _queue_stats["completed"] += 1
+        except render.RenderCancelled:
+            logger.info(f"{task} cancelled by a newer request")
+            with _sched:
+                _queue_stats["cancelled"] += 1
+        except Exception as e:
+            logger.error(f"{task} failed: {e}", exc_info=True)
+        finally:
+            with _sched:
+                _running = None
+            done.set()
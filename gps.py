@@ -1,12 +1,86 @@
+import math
 import time
 import logging
 import threading
+from collections import deque
+
+import boottime
+import nmea
+import simulate
 
 logger = logging.getLogger("gps")
 
 DEFAULT_LATITUDE = 35.700000000000000
 DEFAULT_LONGITUDE = 139.70000000000000
 
+# I2C poll interval (seconds): fast while acquiring a fix, after losing it or
+# after request_update(), GPS_POLL_FIXED while the position moves, then
+# doubling up to GPS_POLL_MAX after every GPS_STABLE_READS readings in which
+# the stable position didn't move
+GPS_POLL_ACQUIRE = 0.5
+GPS_POLL_FIXED = 1.0
+GPS_POLL_MAX = 8.0
+GPS_STABLE_READS = 5
+
+# UART mode: at most one warning per GPS_UART_LOG_INTERVAL seconds for bad
+# NMEA data or read errors, and parser statistics every GPS_UART_STATS_INTERVAL
+GPS_UART_LOG_INTERVAL = 60.0
+GPS_UART_STATS_INTERVAL = 300.0
+
+# Re-initialise the module after it has returned standby data this long
+GPS_STANDBY_RESET = 10.0
+
+# Stable position: moving average of the last GPS_SMOOTHING_WINDOW fixes, only
+# published once it drifts more than GPS_DEADBAND_M metres from the last one
+GPS_SMOOTHING_WINDOW = 10
+GPS_DEADBAND_M = 15.0
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Approximate distance in metres; fine at the scale of GPS jitter."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class PositionFilter:
+    def __init__(self, window=GPS_SMOOTHING_WINDOW, deadband_m=GPS_DEADBAND_M):
+        """
+        Moving average over recent fixes with a deadband on its output.
+
+        :param window: number of fixes averaged
+        :param deadband_m: distance (metres) the average has to move from the
+            current stable position before the stable position follows it
+        """
+        self.window = window
+        self.deadband_m = deadband_m
+        self._fixes = deque(maxlen=window)
+
+        self.latitude = None
+        self.longitude = None
+
+    def reset(self):
+        """Forget the averaged fixes (e.g. after losing the fix). The stable position is kept."""
+        self._fixes.clear()
+
+    def update(self, latitude, longitude):
+        """
+        Add a fix.
+
+        :return: the stable (latitude, longitude)
+        """
+        self._fixes.append((latitude, longitude))
+        count = len(self._fixes)
+        lat = sum(f[0] for f in self._fixes) / count
+        lon = sum(f[1] for f in self._fixes) / count
+
+        if self.latitude is None or distance_m(self.latitude, self.longitude, lat, lon) > self.deadband_m:
+            self.latitude = lat
+            self.longitude = lon
+        return self.latitude, self.longitude
+
 
 class GravityGPS:
     def __init__(
@@ -37,10 +111,36 @@ class GravityGPS:
         self.longitude = DEFAULT_LONGITUDE
         self.has_fix = False
 
+        # Filtered position for consumers that must not follow jitter
+        self.stable_latitude = DEFAULT_LATITUDE
+        self.stable_longitude = DEFAULT_LONGITUDE
+        self._filter = PositionFilter()
+
+        # Fix details, only known in UART mode (from GGA/GSA/RMC)
+        self.fix_quality = None
+        self.fix_type = None
+        self.satellites = None
+        self.hdop = None
+        self.pdop = None
+        self.vdop = None
+        self.rmc_valid = None
+
         self._running = False
         self._thread = None
         self._lock = threading.Lock()
 
+        # Bumped on every published change of location or fix state; the
+        # stable version only when the stable position or fix state changes
+        self.version = 0
+        self.stable_version = 0
+        self._changed = threading.Condition(self._lock)
+        self._subscribers = []
+        # Set to cut the current poll interval short
+        self._wake = threading.Event()
+
+        self.poll_interval = GPS_POLL_ACQUIRE
+        self._i2c_stats = {"transactions": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+
     def start(self):
         """Start the background GPS reading thread."""
         if self._running:
@@ -48,11 +148,13 @@ class GravityGPS:
         self._running = True
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
+        boottime.mark("GPS thread start")
         logger.info("GPS reader thread started")
 
     def stop(self):
         """Stop the background GPS reading thread."""
         self._running = False
+        self._wake.set()
         if self._thread:
             self._thread.join(timeout=2.0)
             logger.info("GPS reader thread stopped")
@@ -66,31 +168,39 @@ class GravityGPS:
             logger.error(f"Unknown GPS mode: {self.mode}")
 
     def _run_i2c(self):
-        import smbus2
+        if simulate.enabled():
+            open_bus = simulate.GnssI2C
+        else:
+            import smbus2
+            open_bus = smbus2.SMBus
 
         bus = None
-        zero_data_count = 0
+        standby_since = None
+        stable_reads = 0
 
         # Wait for system/hardware to stabilize on boot
         time.sleep(3.0)
+        boottime.mark("GPS startup delay")
 
         while self._running:
             try:
                 if bus is None:
-                    bus = smbus2.SMBus(self.i2c_bus)
+                    bus = open_bus(self.i2c_bus)
                     # Initialize GPS Module via I2C commands
                     try:
                         # 1. Enable Power (Write 0x00 to Register 0x23)
-                        bus.write_byte_data(self.i2c_address, 0x23, 0x00)
+                        self._i2c(bus.write_byte_data, self.i2c_address, 0x23, 0x00)
                         time.sleep(0.1)
                         # 2. Set GNSS Mode to GPS+BeiDou+GLONASS (Write 0x07 to Register 0x22)
-                        bus.write_byte_data(self.i2c_address, 0x22, 0x07)
+                        self._i2c(bus.write_byte_data, self.i2c_address, 0x22, 0x07)
                         time.sleep(0.1)
                         # 3. Enable RGB LED indicator (Write 0x05 to Register 0x24)
-                        bus.write_byte_data(self.i2c_address, 0x24, 0x05)
+                        self._i2c(bus.write_byte_data, self.i2c_address, 0x24, 0x05)
                         time.sleep(0.1)
                         logger.info("Sent I2C startup commands to GPS module (Power ON, GPS+BeiDou+GLONASS mode)")
-                        zero_data_count = 0
+                        boottime.mark("GPS I2C init")
+                        standby_since = None
+                        self._set_poll_interval(GPS_POLL_ACQUIRE)
                     except Exception as init_err:
                         logger.warning(f"GPS initialization write failed: {init_err}")
                         try:
@@ -102,7 +212,7 @@ class GravityGPS:
                         continue
                 
                 # Read 23 bytes starting from register 0 using block read
-                raw_data = bus.read_i2c_block_data(self.i2c_address, 0, 23)
+                raw_data = self._i2c(bus.read_i2c_block_data, self.i2c_address, 0, 23)
                 
                 # Extract Time elements (Reg 4-6)
                 hour = raw_data[4]
@@ -142,102 +252,138 @@ class GravityGPS:
                 # it is actively searching for satellites (Do NOT reset).
                 is_standby = (lat_val == 0.0 and lon_val == 0.0 and raw_data[18] == 0 and raw_data[12] == 0)
                 if is_standby:
-                    zero_data_count += 1
-                    if zero_data_count >= 10:
-                        logger.warning("GPS module appears to be in standby (all zero data) for 10s. Retrying full initialization...")
+                    if standby_since is None:
+                        standby_since = time.monotonic()
+                    elif time.monotonic() - standby_since >= GPS_STANDBY_RESET:
+                        logger.warning(f"GPS module appears to be in standby (all zero data) for {GPS_STANDBY_RESET:.0f}s. Retrying full initialization...")
                         try:
                             bus.close()
                         except:
                             pass
                         bus = None
-                        zero_data_count = 0
+                        standby_since = None
                         time.sleep(1.0)
                         continue
                 else:
-                    zero_data_count = 0
+                    standby_since = None
 
                 # Simple validation of coordinates
+                version = self.stable_version
                 if 0.0 <= lat_val <= 90.0 and 0.0 <= lon_val <= 180.0 and not (lat_val == 0.0 and lon_val == 0.0):
-                    with self._lock:
-                        was_fixed = self.has_fix
-                        self.latitude = lat_val
-                        self.longitude = lon_val
-                        self.has_fix = True
-                        if not was_fixed:
-                            logger.info(
-                                f"GPS positioning successful (Fixed)! Lat: {lat_val:.6f}, Lon: {lon_val:.6f}"
-                            )
+                    was_fixed = self._publish(lat_val, lon_val, True)
+                    if not was_fixed:
+                        logger.info(
+                            f"GPS positioning successful (Fixed)! Lat: {lat_val:.6f}, Lon: {lon_val:.6f}"
+                        )
+                        boottime.mark("first I2C fix")
+
+                    if self.stable_version != version:
+                        stable_reads = 0
+                        self._set_poll_interval(GPS_POLL_FIXED)
+                    else:
+                        stable_reads += 1
+                        if stable_reads >= GPS_STABLE_READS:
+                            stable_reads = 0
+                            self._set_poll_interval(min(self.poll_interval * 2, GPS_POLL_MAX))
                 else:
-                    with self._lock:
-                        was_fixed = self.has_fix
-                        self.has_fix = False
-                        if was_fixed:
-                            logger.warning("GPS lost signal (Unfixed)")
+                    was_fixed = self._publish(has_fix=False)
+                    if was_fixed:
+                        logger.warning("GPS lost signal (Unfixed)")
+                    stable_reads = 0
+                    self._set_poll_interval(GPS_POLL_ACQUIRE)
 
             except Exception as e:
                 logger.warning(f"GPS I2C read failed: {e}")
                 bus = None
-                with self._lock:
-                    self.has_fix = False
+                self._publish(has_fix=False)
+                # Back off while the bus keeps failing
+                stable_reads = 0
+                self._set_poll_interval(min(max(self.poll_interval, GPS_POLL_FIXED) * 2, GPS_POLL_MAX))
 
-            time.sleep(1.0)
+            if self._wake.wait(self.poll_interval):
+                self._wake.clear()
+                stable_reads = 0
+                self._set_poll_interval(GPS_POLL_ACQUIRE)
 
     def _run_uart(self):
-        import serial
+        if simulate.enabled():
+            open_serial = simulate.NmeaSerial
+        else:
+            import serial
+            open_serial = serial.Serial
 
         ser = None
+        parser = nmea.NmeaParser()
+        bad_data = nmea.RateLimit(GPS_UART_LOG_INTERVAL)
+        read_failed = nmea.RateLimit(GPS_UART_LOG_INTERVAL)
+        report = nmea.RateLimit(GPS_UART_STATS_INTERVAL)
+        # The first statistics report comes after one interval
+        report()
+        rejected = 0
 
         while self._running:
             try:
                 if ser is None:
-                    ser = serial.Serial(self.port, self.baudrate, timeout=2)
-
-                line = ser.readline().decode("ascii", errors="replace").strip()
-                # Temp debug log to verify serial connection and baudrate
-                logger.info(f"[DEBUG] UART Read: {line}")
-                if not line:
-                    continue
-
-                # Parse standard NMEA-0183 sentences (GNGGA / GPGGA)
-                if line.startswith("$GNGGA") or line.startswith("$GPGGA"):
-                    parts = line.split(",")
-                    if len(parts) > 6:
-                        fix_quality = parts[6]
-                        if fix_quality != "0" and parts[2] and parts[4]:
-                            # Parse Latitude: DDMM.MMMMM
-                            raw_lat = parts[2]
-                            lat_dir = parts[3]
-                            # Parse Longitude: DDDMM.MMMMM
-                            raw_lon = parts[4]
-                            lon_dir = parts[5]
-
-                            lat_val = float(raw_lat[:2]) + float(raw_lat[2:]) / 60.0
-                            if lat_dir == "S":
-                                lat_val = -lat_val
-
-                            lon_val = float(raw_lon[:3]) + float(raw_lon[3:]) / 60.0
-                            if lon_dir == "W":
-                                lon_val = -lon_val
-
-                            with self._lock:
-                                self.latitude = lat_val
-                                self.longitude = lon_val
-                                self.has_fix = True
-                        else:
-                            with self._lock:
-                                self.has_fix = False
+                    ser = open_serial(self.port, self.baudrate, timeout=2)
+
+                # Whatever has arrived, or block (up to the timeout) for the next byte
+                data = ser.read(max(1, ser.in_waiting))
+                for sentence in parser.feed(data):
+                    self._handle_nmea(sentence)
+
+                stats = parser.stats
+                bad = stats["bad_checksum"] + stats["malformed"] + stats["overflow"]
+                if bad > rejected:
+                    rejected = bad
+                    suppressed = bad_data()
+                    if suppressed is not None:
+                        logger.warning(f"GPS UART: rejected NMEA data ({suppressed} more since last report) {stats}")
+                if report() is not None:
+                    logger.debug(f"GPS UART: {stats}, fix {self.get_fix_info()}")
             except Exception as e:
-                logger.warning(f"GPS UART read failed: {e}")
+                suppressed = read_failed()
+                if suppressed is not None:
+                    logger.warning(f"GPS UART read failed: {e} ({suppressed} more since last report)")
                 if ser:
                     try:
                         ser.close()
                     except:
                         pass
                     ser = None
-                with self._lock:
-                    self.has_fix = False
+                self._publish(has_fix=False)
                 time.sleep(2.0)
 
+    def _handle_nmea(self, sentence):
+        kind = sentence.kind
+        if kind == b"GGA":
+            quality = sentence.number(6, int)
+            with self._lock:
+                self.fix_quality = quality
+                self.satellites = sentence.number(7, int)
+                self.hdop = sentence.number(8)
+
+            lat_val = nmea.coordinate(sentence.field(2), sentence.field(3))
+            lon_val = nmea.coordinate(sentence.field(4), sentence.field(5))
+            if quality != 0 and lat_val is not None and lon_val is not None:
+                was_fixed = self._publish(lat_val, lon_val, True)
+                if not was_fixed:
+                    logger.info(
+                        f"GPS positioning successful (Fixed)! Lat: {lat_val:.6f}, Lon: {lon_val:.6f}"
+                    )
+            else:
+                was_fixed = self._publish(has_fix=False)
+                if was_fixed:
+                    logger.warning("GPS lost signal (Unfixed)")
+        elif kind == b"GSA":
+            with self._lock:
+                self.fix_type = sentence.number(2, int)
+                self.pdop = sentence.number(15)
+                self.hdop = sentence.number(16)
+                self.vdop = sentence.number(17)
+        elif kind == b"RMC":
+            with self._lock:
+                self.rmc_valid = sentence.field(2) == b"A"
+
     def get_location(self):
         """
         Get the current latitude and longitude.
@@ -246,3 +392,172 @@ class GravityGPS:
         """
         with self._lock:
             return self.latitude, self.longitude, self.has_fix
+
+    def get_fix_info(self):
+        """
+        Fix details from the last GGA/GSA/RMC sentences (UART mode; None
+        where unknown).
+
+        :return: dict with fix_quality (GGA, 0 = none), fix_type (GSA, 1 =
+            none, 2 = 2D, 3 = 3D), satellites, hdop, pdop, vdop, rmc_valid
+        """
+        with self._lock:
+            return {
+                "fix_quality": self.fix_quality,
+                "fix_type": self.fix_type,
+                "satellites": self.satellites,
+                "hdop": self.hdop,
+                "pdop": self.pdop,
+                "vdop": self.vdop,
+                "rmc_valid": self.rmc_valid,
+            }
+
+    def get_stable_location(self):
+        """
+        Get the filtered position (see PositionFilter), which only moves when
+        the receiver really does.
+
+        :return: (latitude, longitude, has_fix)
+        """
+        with self._lock:
+            return self.stable_latitude, self.stable_longitude, self.has_fix
+
+    def subscribe(self, callback, stable=False):
+        """
+        Call `callback(latitude, longitude, has_fix)` whenever the location or
+        fix state changes, and once right away with the current state.
+        With `stable`, the stable position is passed instead, and jitter that
+        doesn't move it causes no calls.
+        Callbacks run on the GPS thread and should return quickly.
+        """
+        with self._lock:
+            self._subscribers.append((callback, stable))
+            state = self._state(stable)
+        callback(*state)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] != callback]
+
+    def wait_for_update(self, version, timeout=None, stable=False):
+        """
+        Block until the location has changed since `version` (a stable_version
+        with `stable`).
+
+        :return: (version, latitude, longitude, has_fix), unchanged on timeout
+        """
+        with self._changed:
+            if stable:
+                self._changed.wait_for(lambda: self.stable_version != version, timeout)
+                return (self.stable_version,) + self._state(True)
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return (self.version,) + self._state(False)
+
+    def i2c_stats(self):
+        """
+        I2C transaction counters since start.
+
+        :return: dict with transactions, errors, error_rate, latency_avg_ms,
+            latency_max_ms and the current poll_interval
+        """
+        with self._lock:
+            stats = dict(self._i2c_stats)
+            interval = self.poll_interval
+
+        count = stats["transactions"]
+        return {
+            "transactions": count,
+            "errors": stats["errors"],
+            "error_rate": stats["errors"] / count if count else 0.0,
+            "latency_avg_ms": stats["latency_total"] / count * 1000 if count else 0.0,
+            "latency_max_ms": stats["latency_max"] * 1000,
+            "poll_interval": interval,
+        }
+
+    def _i2c(self, fn, *args):
+        """Run one I2C transaction, counting it and its latency."""
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            with self._lock:
+                self._i2c_stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._i2c_stats
+                stats["transactions"] += 1
+                stats["latency_total"] += elapsed
+                stats["latency_max"] = max(stats["latency_max"], elapsed)
+
+    def _set_poll_interval(self, interval):
+        if interval == self.poll_interval:
+            return
+        self.poll_interval = interval
+        stats = self.i2c_stats()
+        logger.info(
+            f"GPS poll interval {interval:.1f}s "
+            f"(I2C: {stats['errors']}/{stats['transactions']} failed, "
+            f"avg {stats['latency_avg_ms']:.2f}ms, max {stats['latency_max_ms']:.2f}ms)"
+        )
+
+    def request_update(self):
+        """Ask the reader thread to poll now rather than at its next tick. Doesn't block."""
+        self._wake.set()
+
+    def _state(self, stable):
+        if stable:
+            return self.stable_latitude, self.stable_longitude, self.has_fix
+        return self.latitude, self.longitude, self.has_fix
+
+    def _publish(self, latitude=None, longitude=None, has_fix=False):
+        """
+        Store a reading, update the stable position and notify waiters and
+        subscribers of whatever changed. latitude/longitude of None keep the
+        last known position.
+
+        :return: whether there was a fix before this reading
+        """
+        with self._lock:
+            was_fixed = self.has_fix
+            if latitude is None:
+                latitude, longitude = self.latitude, self.longitude
+
+            stable = (self.stable_latitude, self.stable_longitude)
+            if has_fix:
+                stable = self._filter.update(latitude, longitude)
+            else:
+                self._filter.reset()
+
+            changed = (latitude, longitude, has_fix) != (self.latitude, self.longitude, was_fixed)
+            moved = stable != (self.stable_latitude, self.stable_longitude)
+            stable_changed = moved or has_fix != was_fixed
+            if not changed and not stable_changed:
+                return was_fixed
+
+            if changed:
+                self.latitude = latitude
+                self.longitude = longitude
+                self.has_fix = has_fix
+                self.version += 1
+            if stable_changed:
+                self.stable_latitude, self.stable_longitude = stable
+                self.stable_version += 1
+            self._changed.notify_all()
+            subscribers = [
+                (callback, self._state(is_stable))
+                for callback, is_stable in self._subscribers
+                if (stable_changed if is_stable else changed)
+            ]
+
+        if moved:
+            logger.info(f"GPS stable position: {stable[0]:.6f}, {stable[1]:.6f}")
+
+        for callback, state in subscribers:
+            try:
+                callback(*state)
+            except Exception as e:
+                logger.warning(f"GPS subscriber failed: {e}")
+
+        return was_fixed
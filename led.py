@@ -1,15 +1,92 @@
 import logging
+import math
 import time
 import threading
-import geocoder
-from gpiozero import DigitalOutputDevice
-from spi import spi_lock, epaper_busy
+
+import boottime
+import led_transport
 from gps import DEFAULT_LATITUDE, DEFAULT_LONGITUDE
+from spi import spi_lock
 
 logger = logging.getLogger("led")
 
+# How frames reach the MAX7219 chain: "lgpio" or "bitbang" (gpiozero) clock
+# DIN/CS/CLK on GPIO 16/20/21, "spi" uses spidev on LED_SPI_BUS/LED_SPI_DEVICE
+# (see README for wiring)
+LED_TRANSPORT = "lgpio"
+LED_SPI_BUS = 1
+LED_SPI_DEVICE = 0
+LED_SPI_SPEED_HZ = 1_000_000
+
+# Only digits that changed are written; every this many ticks all of them are
+# rewritten anyway, so a glitched digit doesn't stay wrong
+LED_FULL_REFRESH_EVERY = 60
+
+# MAX7219 Code-B register values (digits 0-9 are their own codes)
+CODE_MINUS = 0x0A
+CODE_BLANK = 0x0F
+CODE_DP = 0x80
+
+_POW10 = tuple(10 ** i for i in range(24))
+# Digit shown before the register value is known
+_UNKNOWN = 0xFF
+
+
+def encode_int(value, out):
+    """
+    Write the low len(out) decimal digits of `value` (zero padded) into `out`
+    as Code-B registers, out[0] being digit 1 (the rightmost).
+    """
+    for i in range(len(out)):
+        value, out[i] = divmod(value, 10)
+    return out
+
+
+def encode_coordinate(value, out):
+    """
+    Write `value` into `out` the way the coordinate modules show it: 7, 6 or
+    5 decimals for |value| < 10, < 100 and above (7 for negatives), rounded
+    like format(), then cut to the digits that fit, minus sign included.
+    """
+    n = len(out)
+    if not math.isfinite(value):
+        for i in range(n):
+            out[i] = CODE_BLANK
+        return out
+
+    # format() keeps the sign of -0.0 too
+    negative = math.copysign(1.0, value) < 0
+    if negative or value < 10:
+        decimals = 7
+    elif value < 100:
+        decimals = 6
+    else:
+        decimals = 5
+
+    # Round |value| * 10**decimals half-to-even on the exact binary value
+    num, den = abs(value).as_integer_ratio()
+    q, r = divmod(num * _POW10[decimals], den)
+    if 2 * r > den or (2 * r == den and q & 1):
+        q += 1
+
+    int_digits = 1
+    while q >= _POW10[decimals + int_digits]:
+        int_digits += 1
+
+    slots = n - 1 if negative else n
+    # Digits that don't fit are cut, not rounded
+    q //= _POW10[int_digits + decimals - slots]
+
+    for i in range(slots):
+        q, out[i] = divmod(q, 10)
+    if int_digits < slots:
+        out[slots - int_digits] |= CODE_DP
+    if negative:
+        out[n - 1] = CODE_MINUS
+    return out
+
 class SevenSeg:
-    def __init__(self, digits=8, modules=3):
+    def __init__(self, digits=8, modules=3, transport=None):
         logger.info("SevenSeg init start")
 
         self.digits = digits
@@ -21,67 +98,69 @@ class SevenSeg:
 
         self._lat = None
         self._lng = None
+        self._location_dirty = False
         
         # Initialize and start GPS module
         from gps import GravityGPS
         self.gps = GravityGPS(mode="i2c")
         self.gps.start()
-        
-        self._get_location()
 
-        self.din = DigitalOutputDevice(16)
-        self.cs = DigitalOutputDevice(20)
-        self.clk = DigitalOutputDevice(21)
+        # Coordinates are pushed by the GPS thread only when the (filtered)
+        # position actually moves
+        self.gps.subscribe(self._on_location, stable=True)
+
+        if transport is None:
+            transport = self._open_transport()
+        self.transport = transport
 
-        self.cs.on()
+        # Register values last written to each module's digits
+        self._shown = [bytearray(digits) for _ in range(modules)]
+        self._invalidate()
+
+        # Reused every tick: the digits to show per module, and one chain row
+        self._frames = [bytearray(digits) for _ in range(modules)]
+        self._row = bytearray(2 * modules)
 
         self._init_max7219()
+        boottime.mark("_init_max7219")
 
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
 
         logger.info("SevenSeg init done / thread start")
 
-    def _get_location(self):
-        lat, lng, has_fix = self.gps.get_location()
+    def _on_location(self, lat, lng, has_fix):
         with self._lock:
             self._lat = lat
             self._lng = lng
+            self._location_dirty = True
 
     def refresh_location(self):
         logger.info("refresh location")
-        threading.Thread(target=self._get_location, daemon=True).start()
-
-    def _pulse(self):
-        self.clk.off()
-        self.clk.on()
-
-    def _shift_out(self, byte):
-        for _ in range(8):
-            self.clk.off()
-            self.din.value = (byte & 0x80) != 0
-            byte <<= 1
-            self.clk.on()
+        self.gps.request_update()
+
+    def _open_transport(self):
+        if LED_TRANSPORT == "spi":
+            # SPI0 is shared with the e-paper; SPI1 is ours alone
+            return led_transport.open_transport(
+                "spi",
+                bus=LED_SPI_BUS,
+                device=LED_SPI_DEVICE,
+                speed_hz=LED_SPI_SPEED_HZ,
+                lock=spi_lock if LED_SPI_BUS == 0 else None,
+            )
+        return led_transport.open_transport(LED_TRANSPORT)
+
+    def _invalidate(self):
+        for shown in self._shown:
+            shown[:] = bytes([_UNKNOWN]) * self.digits
+        self._ticks_since_full = 0
 
     def _write(self, reg, data):
-        self.cs.off()
-        self._shift_out(reg)
-        self._shift_out(data)
-        self.cs.on()
-
-    def _write_to_module(self, module_idx, reg, data):
-        self.cs.off()
-        for i in range(self.modules - 1, -1, -1):
-            if i == module_idx:
-                self._shift_out(reg)
-                self._shift_out(data)
-            else:
-                self._shift_out(0x00)
-                self._shift_out(0x00)
-        self.cs.on()
+        self.transport.send(bytes((reg, data)))
 
     def _init_max7219(self):
-        logger.info("init MAX7219(bitbang)")
+        logger.info(f"init MAX7219 ({type(self.transport).__name__})")
         self._write(0x09, 0xFF)
         self._write(0x0A, 0x0F)
         self._write(0x0B, self.digits - 1)
@@ -92,112 +171,87 @@ class SevenSeg:
     def clear(self):
         for i in range(1, self.digits+1):
             self._write(i, 0x0F)
+        self._invalidate()
 
     def set_mode(self, mode):
         with self._lock:
             self.mode = mode.name
-            self._frozen_value = ""
+            self._frozen_value = None
 
-    def freeze(self):
+    def freeze(self, value=None):
+        """
+        Hold the time digits on `value` (UNIX seconds, default now) until unfreeze().
+        """
         with self._lock:
-            if not self._frozen_value:
-                self._frozen_value = self._unix_time()
+            if self._frozen_value is None:
+                if value is None:
+                    self._frozen_value = self._unix_time()
+                else:
+                    self._frozen_value = int(value) % _POW10[self.digits]
 
     def unfreeze(self):
         with self._lock:
             self._frozen_value = None
 
     def _unix_time(self):
-        return f"{int(time.time()) % 100_000_000:08d}"
-
-    def _format_coordinate(self, value):
-        if value >= 100:
-            formatted = f"{value:09.5f}"
-        elif value >= 10:
-            formatted = f"{value:09.6f}"
-        else:
-            formatted = f"{value:09.7f}"
-        
-        return formatted[:10] if value < 0 else formatted[:9]
-
-
-    def _parse(self, s):
-        out = []
-        i = 0
-        digit_count = 0
-
-        while i < len(s) and digit_count < self.digits:
-            ch = s[i]
-            if ch == ".":
-                if out:
-                    out[-1] = out[-1] | 0x80
-                i += 1
-            elif ch.isdigit():
-                out.append(int(ch))
-                digit_count += 1
-                i+=1
-            elif ch == "-":
-                out.append(0x0A)
-                digit_count += 1
-                i+=1
-            else:
-                out.append(0x0f)
-                i+=1
-
-        while len(out) < self.digits:
-            out.append(0x0F)
-        return list(reversed(out))
-
-    def _display(self, s):
-        for i, v in enumerate(self._parse(s)):
-            self._write(i+1, v)
-
-    def _display_all(self, module_values):
+        return int(time.time()) % _POW10[self.digits]
+
+    def _display_all(self, frames):
+        """
+        Show `frames` (one register array per module, digit 1 first), writing
+        only the digit rows that differ from what the chain already shows.
+        """
         try:
-            for digit_pos in range(1, self.digits + 1):
-                if epaper_busy.is_set():
-                    return
-                self.cs.off()
-                for module_idx in range(self.modules - 1, -1, -1):
-                    if module_idx < len(module_values):
-                        parsed = self._parse(module_values[module_idx])
-                        value = parsed[digit_pos - 1]
+            self._ticks_since_full += 1
+            if self._ticks_since_full >= LED_FULL_REFRESH_EVERY:
+                self._invalidate()
+            shown = self._shown
+            row = self._row
+            last = self.modules - 1
+
+            for i in range(self.digits):
+                if all(frame[i] == seen[i] for frame, seen in zip(frames, shown)):
+                    continue
+
+                # One row per digit: the whole chain, farthest module first.
+                # Modules whose digit is unchanged get a no-op
+                for module_idx in range(self.modules):
+                    value = frames[module_idx][i]
+                    at = 2 * (last - module_idx)
+                    if value == shown[module_idx][i]:
+                        row[at] = 0x00
+                        row[at + 1] = 0x00
                     else:
-                        value = 0x0F
-                    self._shift_out(digit_pos)
-                    self._shift_out(value)
-                self.cs.on()
+                        row[at] = i + 1
+                        row[at + 1] = value
+                self.transport.send(row)
+
+                for frame, seen in zip(frames, shown):
+                    seen[i] = frame[i]
         except Exception as e:
             logger.error(f"Display Error: {e}")
-            try:
-                self.cs.on()
-            except:
-                pass
+            # Whatever reached the chain is unknown now; rewrite everything next tick
+            self._invalidate()
 
     def _run(self):
         logger.info("display thread running")
         next_tick = time.time()
 
         while self._running:
-            if epaper_busy.is_set():
-                time.sleep(0.05)
-                next_tick = time.time() + 1
-                continue
-        
             try:
-                # Fetch the latest location from GPS dynamically on each tick
-                self._get_location()
-                
+                frames = self._frames
                 with self._lock:
-                    if self._frozen_value:
-                        module0_value = self._frozen_value
+                    if self._frozen_value is not None:
+                        encode_int(self._frozen_value, frames[0])
                     else:
-                        module0_value = self._unix_time()
+                        encode_int(self._unix_time(), frames[0])
+
+                    if self._location_dirty:
+                        encode_coordinate(self._lat, frames[1])
+                        encode_coordinate(self._lng, frames[2])
+                        self._location_dirty = False
 
-                    module1_value = self._format_coordinate(self._lat)
-                    module2_value = self._format_coordinate(self._lng)
-                    
-                self._display_all([module0_value, module1_value, module2_value])
+                self._display_all(frames)
 
                 next_tick += 1
                 sleep_time = max(0, next_tick - time.time())
@@ -213,5 +267,6 @@ class SevenSeg:
 
     def stop(self):
         self._running = False
-        if self._thread.is_active():
+        if self._thread.is_alive():
             self._thread.join(timeout=2.0)
+        self.transport.close()
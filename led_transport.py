@@ -0,0 +1,233 @@
+import logging
+import time
+
+logger = logging.getLogger("led")
+
+
+class BitBangTransport:
+    def __init__(self, din=16, cs=20, clk=21):
+        """
+        Software SPI for the MAX7219 chain through gpiozero output devices.
+
+        :param din: GPIO for DIN
+        :param cs: GPIO for CS/LOAD
+        :param clk: GPIO for CLK
+        """
+        from gpiozero import DigitalOutputDevice
+
+        self.din = DigitalOutputDevice(din)
+        self.cs = DigitalOutputDevice(cs)
+        self.clk = DigitalOutputDevice(clk)
+
+        self.cs.on()
+
+    def _shift_out(self, byte):
+        for _ in range(8):
+            self.clk.off()
+            self.din.value = (byte & 0x80) != 0
+            byte <<= 1
+            self.clk.on()
+
+    def send(self, data):
+        """Clock out `data` MSB first in one CS frame; the chain latches on CS rising."""
+        self.cs.off()
+        try:
+            for byte in data:
+                self._shift_out(byte)
+        finally:
+            self.cs.on()
+
+    def close(self):
+        for dev in (self.din, self.cs, self.clk):
+            dev.close()
+
+
+# lgpio group bits, in the order the pins are claimed
+_DIN = 0x1
+_CLK = 0x2
+_CS = 0x4
+_GROUP_MASK = _DIN | _CLK | _CS
+
+
+def _byte_waves():
+    # For every byte value, the 16 group states that clock it out MSB first
+    # with CS held low: (CLK low, DIN = bit) then (CLK high, DIN = bit)
+    waves = []
+    for byte in range(256):
+        states = []
+        for shift in range(7, -1, -1):
+            din = _DIN if (byte >> shift) & 1 else 0
+            states.append(din)
+            states.append(din | _CLK)
+        waves.append(tuple(states))
+    return tuple(waves)
+
+
+class LgpioTransport:
+    def __init__(self, din=16, cs=20, clk=21, chip=0):
+        """
+        Software SPI for the MAX7219 chain straight through lgpio. DIN, CLK
+        and CS are claimed as one output group, so every clock edge is a
+        single group_write with no pin-factory layers in between.
+
+        :param din: GPIO for DIN
+        :param cs: GPIO for CS/LOAD
+        :param clk: GPIO for CLK
+        :param chip: gpiochip number
+        """
+        import lgpio
+
+        self._lgpio = lgpio
+        self._handle = lgpio.gpiochip_open(chip)
+        self._leader = din
+        try:
+            lgpio.group_claim_output(self._handle, [din, clk, cs], [0, 0, 1])
+        except Exception:
+            lgpio.gpiochip_close(self._handle)
+            raise
+        self._waves = _byte_waves()
+
+    def send(self, data):
+        write = self._lgpio.group_write
+        handle = self._handle
+        leader = self._leader
+        waves = self._waves
+
+        write(handle, leader, 0, _GROUP_MASK)
+        try:
+            for byte in data:
+                for state in waves[byte]:
+                    write(handle, leader, state, _GROUP_MASK)
+        finally:
+            write(handle, leader, _CS | _CLK, _GROUP_MASK)
+
+    def close(self):
+        try:
+            self._lgpio.group_free(self._handle, self._leader)
+        finally:
+            self._lgpio.gpiochip_close(self._handle)
+
+
+class SpiTransport:
+    def __init__(self, bus=1, device=0, speed_hz=1_000_000, lock=None):
+        """
+        Hardware SPI (spidev) for the MAX7219 chain. A whole daisy-chain row
+        goes out in a single xfer2 call.
+
+        :param bus: SPI bus (1 = SPI1, see README for wiring/overlay)
+        :param device: chip select on that bus
+        :param speed_hz: SPI clock (MAX7219 is rated up to 10 MHz)
+        :param lock: lock to hold per transfer when the bus is shared (SPI0)
+        """
+        import spidev
+
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.max_speed_hz = speed_hz
+        self.spi.mode = 0b00
+        self._lock = lock
+
+    def send(self, data):
+        if self._lock is None:
+            self.spi.xfer2(list(data))
+            return
+        with self._lock:
+            self.spi.xfer2(list(data))
+
+    def close(self):
+        self.spi.close()
+
+
+def open_transport(kind="lgpio", **kwargs):
+    """
+    Create the MAX7219 transport named by `kind` ("spi", "lgpio" or "bitbang").
+    Falls back to the next one down the list (on the default pins) when a
+    backend can't be opened. Under CREATEDAT_HARDWARE=sim every kind is the
+    simulated chain.
+    """
+    import simulate
+
+    if simulate.enabled():
+        logger.info("MAX7219 transport: simulated")
+        return simulate.Max7219Chain()
+
+    if kind == "spi":
+        try:
+            transport = SpiTransport(**kwargs)
+            logger.info(f"MAX7219 transport: hardware SPI {kwargs}")
+            return transport
+        except Exception as e:
+            logger.warning(f"hardware SPI unavailable, falling back to lgpio: {e}")
+        kind = "lgpio"
+        kwargs = {}
+
+    if kind == "lgpio":
+        try:
+            transport = LgpioTransport(**kwargs)
+            logger.info("MAX7219 transport: lgpio bit-bang")
+            return transport
+        except Exception as e:
+            logger.warning(f"lgpio unavailable, falling back to gpiozero: {e}")
+    elif kind != "bitbang":
+        logger.warning(f"Unknown MAX7219 transport {kind!r}, using bit-bang")
+        kwargs = {}
+
+    logger.info("MAX7219 transport: bit-bang")
+    return BitBangTransport(**kwargs)
+
+
+def benchmark(kinds=("bitbang", "lgpio", "spi"), rows=2000, row_bytes=6):
+    """
+    Send `rows` chain rows of `row_bytes` bytes through each transport and
+    log throughput and CPU time per row. Blanks the display while it runs.
+    """
+    # Digit register 1 with Code-B blank on every module
+    row = bytes([0x01, 0x0F] * (row_bytes // 2))
+    results = {}
+
+    for kind in kinds:
+        try:
+            if kind == "spi":
+                transport = SpiTransport()
+            elif kind == "lgpio":
+                transport = LgpioTransport()
+            else:
+                transport = BitBangTransport()
+        except Exception as e:
+            logger.warning(f"{kind}: unavailable ({e})")
+            continue
+
+        try:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            for _ in range(rows):
+                transport.send(row)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+        finally:
+            transport.close()
+
+        sent = rows * len(row)
+        results[kind] = {
+            "bytes_per_s": sent / wall if wall else float("inf"),
+            "cpu_us_per_row": cpu / rows * 1e6,
+        }
+        logger.info(
+            f"{kind:<8} {results[kind]['bytes_per_s']:10.0f} bytes/s  "
+            f"{results[kind]['cpu_us_per_row']:8.1f} us CPU per row"
+        )
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="MAX7219 transport micro-benchmark")
+    parser.add_argument("--rows", type=int, default=2000, help="chain rows to send per transport")
+    parser.add_argument("kinds", nargs="*", default=["bitbang", "lgpio", "spi"])
+    args = parser.parse_args()
+
+    benchmark(args.kinds, args.rows)
@@ -29,26 +29,116 @@
 
 
 import logging
+from contextlib import nullcontext
 from . import epdconfig
 
 # Import for hack method
-import random
-import numpy as np
-from noise import pnoise1
-from noise import pnoise2
-from decimal import Decimal, getcontext
-import hashlib
+# numpy, decimal, hashlib and the Perlin engine are imported where they are
+# used, so importing the driver stays cheap at boot
 import math
 import time
 from datetime import datetime
-import geocoder
 
 # Display resolution
 EPD_WIDTH       = 800
 EPD_HEIGHT      = 480
 
+# BUSY handling: give up after BUSY_TIMEOUT seconds instead of hanging forever
+BUSY_TIMEOUT    = 60
+BUSY_WAIT_MS    = 500   # edge wait slice, re-sends 0x71 in between
+BUSY_POLL_MS    = 20    # poll interval when the backend has no edge wait
+
 logger = logging.getLogger(__name__)
 
+def _strip_leading_zeros(bits):
+    # Same bits as bin(...)[2:]: leading zeros dropped, but never empty
+    import numpy as np
+
+    ones = np.flatnonzero(bits)
+    if ones.size == 0:
+        return bits[-1:]
+    return bits[ones[0]:]
+
+def _as_uint8(data):
+    # bytes/bytearray/memoryview/ndarray without copying; lists of ints are converted
+    import numpy as np
+
+    if isinstance(data, np.ndarray):
+        return np.ascontiguousarray(data, dtype=np.uint8).reshape(-1)
+    try:
+        return np.frombuffer(data, dtype=np.uint8)
+    except TypeError:
+        return np.asarray(data, dtype=np.uint8)
+
+def _int_to_bits(n):
+    import numpy as np
+
+    raw = n.to_bytes(max(1, (n.bit_length() + 7) // 8), "big")
+    return _strip_leading_zeros(np.unpackbits(np.frombuffer(raw, dtype=np.uint8)))
+
+# hash_mode 0 seeds are read as their str() (as Decimal(str(n)) did) and the
+# multi-number quantization used to run in 200-digit Decimal arithmetic
+SEED_DECIMAL_PREC = 200
+# Within this relative distance of a rounding tie the exact result can differ
+# from the 200-digit one, so those lists take the Decimal path
+_TIE_MARGIN = 10 ** (SEED_DECIMAL_PREC - 10)
+
+def _seed_int(n):
+    # int(Decimal(str(n))) without the Decimal for the common types
+    if isinstance(n, int):
+        return int(n)
+    if isinstance(n, float) and -2.0 ** 53 < n < 2.0 ** 53:
+        # Below 2**53 every integer is a float, so truncating n or its
+        # shortest repr gives the same integer; above it they can differ
+        return int(n)
+    from decimal import Decimal
+    return int(Decimal(str(n)))
+
+def _quantize_decimal(nums):
+    from decimal import localcontext
+
+    with localcontext() as ctx:
+        ctx.prec = SEED_DECIMAL_PREC
+        vmin = min(nums)
+        vmax = max(nums)
+        quantized = []
+        for n in nums:
+            norm = (n-vmin)/(vmax-vmin)
+            norm = max(min(norm, 1), 0)
+            quantized.append(int((norm*3).to_integral_value(rounding="ROUND_HALF_UP")))
+    return quantized
+
+def _quantize_seeds(numbers):
+    """
+    round_half_up(3 * (n - min) / (max - min)) for each of `numbers`, exactly
+    as the 200-digit Decimal code computed it, or None if they are all equal.
+    """
+    from decimal import Decimal
+
+    nums = [Decimal(str(n)) for n in numbers]
+    if not all(n.is_finite() for n in nums):
+        return _quantize_decimal(nums)
+
+    # Scale every seed to an integer over one common denominator
+    ratios = [n.as_integer_ratio() for n in nums]
+    den = math.lcm(*(d for _, d in ratios))
+    values = [p * (den // d) for p, d in ratios]
+    vmin = min(values)
+    span = max(values) - vmin
+    if span == 0:
+        return None
+
+    # q = floor((6 * (v - vmin) + span) / (2 * span)); r tells how close it was to a tie
+    two_span = 2 * span
+    near_tie = two_span // _TIE_MARGIN
+    quantized = []
+    for v in values:
+        q, r = divmod(6 * (v - vmin) + span, two_span)
+        if min(r, two_span - r) <= near_tie:
+            return _quantize_decimal(nums)
+        quantized.append(q)
+    return quantized
+
 class EPD:
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
@@ -58,6 +148,12 @@ class EPD:
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
         self.partFlag=1
+        self._const_frames = {}
+        self.busy_timeout = BUSY_TIMEOUT
+        # Optional lock held only while bytes are clocked out, and an optional
+        # Event set while waiting on BUSY; both are shared by the caller
+        self.spi_lock = nullcontext()
+        self.refreshing = None
 
     # Hardware reset
     def reset(self):
@@ -69,31 +165,54 @@ class EPD:
         epdconfig.delay_ms(200)   
 
     def send_command(self, command):
-        epdconfig.digital_write(self.dc_pin, 0)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([command])
-        epdconfig.digital_write(self.cs_pin, 1)
+        with self.spi_lock:
+            epdconfig.digital_write(self.dc_pin, 0)
+            epdconfig.digital_write(self.cs_pin, 0)
+            epdconfig.spi_writebyte([command])
+            epdconfig.digital_write(self.cs_pin, 1)
 
     def send_data(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([data])
-        epdconfig.digital_write(self.cs_pin, 1)
+        with self.spi_lock:
+            epdconfig.digital_write(self.dc_pin, 1)
+            epdconfig.digital_write(self.cs_pin, 0)
+            epdconfig.spi_writebyte([data])
+            epdconfig.digital_write(self.cs_pin, 1)
     
     def send_data2(self, data): #faster
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte2(data)
-        epdconfig.digital_write(self.cs_pin, 1)
-
-    def ReadBusy(self):
+        with self.spi_lock:
+            epdconfig.digital_write(self.dc_pin, 1)
+            epdconfig.digital_write(self.cs_pin, 0)
+            epdconfig.spi_writebyte2(data)
+            epdconfig.digital_write(self.cs_pin, 1)
+
+    def ReadBusy(self, timeout=None):
+        if timeout is None:
+            timeout = self.busy_timeout
         logger.debug("e-Paper busy")
-        self.send_command(0x71)
-        busy = epdconfig.digital_read(self.busy_pin)
-        while(busy == 0):
+
+        # Sleep on the BUSY edge when the backend supports it, otherwise poll slowly
+        wait = getattr(epdconfig, "digital_wait", None)
+        deadline = time.monotonic() + timeout
+
+        if self.refreshing is not None:
+            self.refreshing.set()
+        try:
             self.send_command(0x71)
             busy = epdconfig.digital_read(self.busy_pin)
-        epdconfig.delay_ms(200)
+            while(busy == 0):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"e-Paper still busy after {timeout}s")
+                if wait is not None:
+                    wait(self.busy_pin, 1, min(remaining, BUSY_WAIT_MS / 1000.0))
+                else:
+                    epdconfig.delay_ms(min(remaining * 1000.0, BUSY_POLL_MS))
+                self.send_command(0x71)
+                busy = epdconfig.digital_read(self.busy_pin)
+            epdconfig.delay_ms(200)
+        finally:
+            if self.refreshing is not None:
+                self.refreshing.clear()
         logger.debug("e-Paper busy release")
         
     def init(self):
@@ -197,9 +316,10 @@ class EPD:
         return 0
 
 
-    # 数字をbit文字列へ(2進数化 or hash化) -----
-    def numbers_to_bitstring(self, numbers, hash_mode=0):
-        getcontext().prec = 200
+    # 数字をbit配列へ(2進数化 or hash化) -----
+    def numbers_to_bits(self, numbers, hash_mode=0):
+        import hashlib
+        import numpy as np
 
         #Create a list if numbers is a single value
         if not isinstance(numbers, (list, tuple)):
@@ -209,55 +329,48 @@ class EPD:
         seed = ",".join(str(n) for n in numbers).encode()
         match hash_mode:
             case 0:
-                nums = [Decimal(str(n)) for n in numbers]
-
-                vmin = min(nums)
-                vmax = max(nums)
+                if len(numbers) == 1:
+                    return _int_to_bits(_seed_int(numbers[0]))
 
-                pattern_bits = ""
+                quantized = _quantize_seeds(numbers)
+                if quantized is None:
+                    return _int_to_bits(_seed_int(numbers[0]))
 
-                if vmin == vmax:
-                    n = nums[0]
-                    bits = bin(int(n))[2:]
-                    return bits
+                q = np.asarray(quantized, dtype=np.uint8)
+                pattern_bits = np.stack([q >> 1, q & 1], axis=1).ravel()
 
-                for n in nums:
-                    norm = (n-vmin)/(vmax-vmin) 
-                    norm = max(min(norm, 1), 0)
-                    q = int((norm*3).to_integral_value(rounding="ROUND_HALF_UP"))
-                    bits = format(q, "02b")
-                    pattern_bits += bits
-
-                print("Pattern Bits", pattern_bits)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"pattern bits {pattern_bits}")
 
                 return pattern_bits
             case 1:
-                digest = hashlib.md5(seed).hexdigest()
+                digest = hashlib.md5(seed).digest()
             case 2:
-                digest = hashlib.sha1(seed).hexdigest()
+                digest = hashlib.sha1(seed).digest()
             case 3:
-                digest = hashlib.sha224(seed).hexdigest()
+                digest = hashlib.sha224(seed).digest()
             case 4:
-                digest = hashlib.sha384(seed).hexdigest()
+                digest = hashlib.sha384(seed).digest()
             case 5:
-                digest = hashlib.sha512(seed).hexdigest()
+                digest = hashlib.sha512(seed).digest()
             case 6:
-                digest = hashlib.sha3_224(seed).hexdigest()
+                digest = hashlib.sha3_224(seed).digest()
             case 7:
-                digest = hashlib.sha3_256(seed).hexdigest()
+                digest = hashlib.sha3_256(seed).digest()
             case 8:
-                digest = hashlib.sha3_384(seed).hexdigest()
+                digest = hashlib.sha3_384(seed).digest()
             case 9:
-                digest = hashlib.sha3_512(seed).hexdigest()
+                digest = hashlib.sha3_512(seed).digest()
             case _:
-                digest = hashlib.sha256(seed).hexdigest()
-            
-        binary_str = bin(int(digest, 16))[2:]
-        return binary_str
+                digest = hashlib.sha256(seed).digest()
 
+        return _strip_leading_zeros(np.unpackbits(np.frombuffer(digest, dtype=np.uint8)))
+
+
+    # bit配列から1枚絵を生成 -----
+    def makebuffer_from_bits(self, pattern_bits, block_size=1):
+        import numpy as np
 
-    # bit文字列から1枚絵を生成 -----
-    def makebuffer_from_bitstring(self, pattern_bits, block_size=1):
         width = self.width
         height = self.height
 
@@ -267,90 +380,52 @@ class EPD:
         block_width = math.ceil(width/block_size)
         block_height = math.ceil(height/block_size)
 
-        repeated_blocks = (pattern_bits * math.ceil(block_width*block_height/len(pattern_bits)))[:block_width*block_height]
+        # Tile the pattern over the block grid, then blow each block up to block_size x block_size pixels
+        blocks = np.resize(pattern_bits, block_width*block_height).reshape(block_height, block_width)
+        expanded = np.repeat(np.repeat(blocks, block_size, axis=0), block_size, axis=1)[:, :width]
 
-        expanded_bits = []
+        return bytearray(np.packbits(expanded.ravel()[:total_bits]).tobytes())
 
-        for row in range(block_height):
-            row_bits = repeated_blocks[row*block_width:(row+1)*block_width]
-            expanded_row = ''.join(bit*block_size for bit in row_bits)
-            for _ in range(block_size):
-                expanded_bits.append(expanded_row[:width])
-
-        expanded_bitstring = ''.join(expanded_bits)[:total_bits]
+    # '0'/'1' string versions of the above, kept for callers that still use them -----
+    def numbers_to_bitstring(self, numbers, hash_mode=0):
+        import numpy as np
 
-        pad_len = (8-len(expanded_bitstring)%8)%8
-        expanded_bitstring = expanded_bitstring + '0' * pad_len
+        bits = self.numbers_to_bits(numbers, hash_mode)
+        return (bits.astype(np.uint8) + ord("0")).tobytes().decode("ascii")
 
-        buf = bytearray(
-            int(expanded_bitstring[i:i+8], 2)
-            for i in range(0, len(expanded_bitstring), 8)
-        )
+    def makebuffer_from_bitstring(self, pattern_bits, block_size=1):
+        import numpy as np
 
-        return buf
+        bits = np.frombuffer(pattern_bits.encode("ascii"), dtype=np.uint8) - ord("0")
+        return self.makebuffer_from_bits(bits, block_size)
 
-    def generatebuffer_time(self, hash_mode, block_size):
-        t = time.time()
-        dt = datetime.now()
-        print(t)
-        print(dt)
+    def generatebuffer_time(self, hash_mode, block_size, t=None):
+        if t is None:
+            t = time.time()
+        logger.debug(f"time pattern for {t} ({datetime.fromtimestamp(t)})")
 
-        bit_str = self.numbers_to_bitstring(t, hash_mode)
-        buf = self.makebuffer_from_bitstring(bit_str, block_size)
+        bits = self.numbers_to_bits(t, hash_mode)
+        buf = self.makebuffer_from_bits(bits, block_size)
         
         return buf
 
     def generatebuffer_perlin(self, base_buffer, ns, nsX, nsY):
+        from . import perlin
+
         width = self.width
         height = self.height
         total_bits = width * height
 
-        bits = ''.join(f"{byte:08b}" for byte in base_buffer)
+        bits = perlin.base_bits(base_buffer, total_bits)
+        rows = perlin.threshold_rows(bits, width, 0, height, ns, nsX, nsY)
 
-        if len(bits) < total_bits:
-            repeat = total_bits // len(bits) + 1
-            bits = (bits * repeat)[:total_bits]
-        else:
-            bits = bits[:total_bits]
-
-        buffer = []
-
-        scale = ns 
-        nxscale = nsX
-        nyscale = nsY
-
-        for y in range(height):
-            byte = 0
-            for x in range(width):
-                b = x + x * y
-                byte_str = bits[b:b+8]
-                
-                if len(byte_str) < 8:
-                    byte_str = byte_str.ljust(8, "0")
-
-                byte_val = int(byte_str, 2)
-
-                nx = x * scale + byte_val * nxscale
-                ny = y * scale + byte_val * nyscale
-
-                n = pnoise2(nx, ny)
-
-                bit = 1 if n > 0 else 0
-
-                byte = (byte << 1) | bit
-
-                if(x+1) % 8 == 0:
-                    buffer.append(byte)
-                    byte = 0
-
-            if width % 8 != 0:
-                buffer.append(byte << (8-width%8))
-        
-        return buffer
+        return bytearray(rows.tobytes())
                 
 
     # Original Generate Buffer function -----
     def getbuffer(self, image):
+        import numpy as np
+
         img = image
         imwidth, imheight = img.size
         if(imwidth == self.width and imheight == self.height):
@@ -363,21 +438,28 @@ class EPD:
             # return a blank buffer
             return [0x00] * (int(self.width/8) * self.height)
 
-        buf = bytearray(img.tobytes('raw'))
         # The bytes need to be inverted, because in the PIL world 0=black and 1=white, but
         # in the e-paper world 0=white and 1=black.
-        for i in range(len(buf)):
-            buf[i] ^= 0xFF
-        return buf
+        buf = np.invert(np.frombuffer(img.tobytes('raw'), dtype=np.uint8))
+        return bytearray(buf.tobytes())
+
+    # Constant full-screen frame filled with `value`, built once per instance
+    def const_frame(self, value):
+        frame = self._const_frames.get(value)
+        if frame is None:
+            frame = bytes([value]) * (int(self.width/8) * self.height)
+            self._const_frames[value] = frame
+        return frame
 
     def display(self, imageblack, imagered):
+        import numpy as np
+
+        # Accepts bytes/bytearray/memoryview/ndarray; imageblack is not modified
         self.send_command(0x10)
-        for i in range(len(imageblack)):
-            imageblack[i] ^= 0xFF
-        self.send_data2(imageblack)
+        self.send_data2(np.invert(_as_uint8(imageblack)))
 
         self.send_command(0x13)
-        self.send_data2(imagered)
+        self.send_data2(_as_uint8(imagered))
         
         self.send_command(0x12)
         epdconfig.delay_ms(100)
@@ -439,9 +521,7 @@ class EPD:
         if self.partFlag == 1:
             self.partFlag = 0
             self.send_command(0x10)
-            for j in range(Height):
-                    for i in range(Width):
-                        self.send_data(0xff)
+            self.send_data2(bytes([0xff]) * (Width * Height))
 
         self.send_command(0x13)   #Write Black and White image to RAM
         self.send_data2(Image)
@@ -451,15 +531,11 @@ class EPD:
         self.ReadBusy()
         
     def Clear(self):
-        # Original buffer frame
-        buf = [0x00] * (int(self.width/8) * self.height)    #bw
-        buf2 = [0xff] * (int(self.width/8) * self.height)   #red
-
         self.send_command(0x10)
-        self.send_data2(buf2)
+        self.send_data2(self.const_frame(0xff))
             
         self.send_command(0x13)
-        self.send_data2(buf)
+        self.send_data2(self.const_frame(0x00))
                 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
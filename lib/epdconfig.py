@@ -31,7 +31,7 @@ import os
 import logging
 import sys
 import time
-import subprocess
+import threading
 
 from ctypes import *
 
@@ -97,6 +97,15 @@ class RaspberryPi:
         elif pin == self.PWR_PIN:
             return self.PWR_PIN.value
 
+    def digital_wait(self, pin, value, timeout):
+        # Block until the pin reads `value` or timeout (s) expires; True if it did
+        if pin == self.BUSY_PIN:
+            if value:
+                return self.GPIO_BUSY_PIN.wait_for_active(timeout)
+            return self.GPIO_BUSY_PIN.wait_for_inactive(timeout)
+        time.sleep(timeout)
+        return self.digital_read(pin) == value
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
@@ -303,22 +312,163 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class Simulated:
+    """
+    Headless stand-in for the panel, selected with CREATEDAT_HARDWARE=sim.
+    SPI bytes are counted and timed per command, and BUSY goes low after a
+    refresh (0x12) or power-on (0x04) for as long as the real panel would.
+    """
+    # Pin definition (same numbers as the Raspberry Pi wiring)
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+    MOSI_PIN = 10
+    SCLK_PIN = 11
+
+    def __init__(self):
+        # Seconds BUSY stays low; full refresh of the tri-colour panel takes ~16s
+        self.refresh_s = float(os.environ.get('CREATEDAT_SIM_REFRESH', '16.0'))
+        self.partial_refresh_s = float(os.environ.get('CREATEDAT_SIM_PARTIAL_REFRESH', '1.0'))
+        self.power_on_s = 0.1
+        # SPI clock used to turn byte counts into transfer time
+        self.spi_hz = 4000000
+        # Multiplies every simulated wait (0 = don't wait at all)
+        self.time_scale = float(os.environ.get('CREATEDAT_SIM_TIME_SCALE', '1.0'))
+
+        self.pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        self.spi_bytes = 0
+        self.refreshes = 0
+        # Last data written after each command, e.g. the frames after 0x10/0x13
+        self.last_data = {}
+        self.transfers = []
+
+        self._busy_until = 0.0
+        self._command = None
+        self._partial = False
+        self._lock = threading.Lock()
+
+    def digital_write(self, pin, value):
+        self.pins[pin] = value
+        if pin == self.RST_PIN and not value:
+            self._partial = False
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self._busy_until else 1
+        return self.pins.get(pin, 0)
+
+    def digital_wait(self, pin, value, timeout):
+        if pin == self.BUSY_PIN and value:
+            remaining = self._busy_until - time.monotonic()
+            time.sleep(max(0.0, min(remaining, timeout)))
+        else:
+            time.sleep(timeout * self.time_scale)
+        return self.digital_read(pin) == value
+
+    def delay_ms(self, delaytime):
+        if self.time_scale:
+            time.sleep(delaytime * self.time_scale / 1000.0)
+
+    def _transfer(self, data):
+        data = bytes(data)
+        now = time.monotonic()
+        with self._lock:
+            self.spi_bytes += len(data)
+            if self.pins[self.DC_PIN]:
+                self.last_data.setdefault(self._command, bytearray()).extend(data)
+            else:
+                self._begin_command(data[-1], now)
+            if len(data) > 1:
+                self.transfers.append((now, self._command, len(data)))
+                del self.transfers[:-256]
+        # Take as long as the bytes would on the wire
+        if self.time_scale:
+            time.sleep(len(data) * 8 / self.spi_hz * self.time_scale)
+
+    def _begin_command(self, command, now):
+        self._command = command
+        self.last_data[command] = bytearray()
+        if command == 0x12:
+            self.refreshes += 1
+            duration = self.partial_refresh_s if self._partial else self.refresh_s
+            self._busy_until = now + duration * self.time_scale
+        elif command == 0x04:
+            self._busy_until = now + self.power_on_s * self.time_scale
+        elif command == 0x91:
+            self._partial = True
+
+    def spi_writebyte(self, data):
+        self._transfer(data)
+
+    def spi_writebyte2(self, data):
+        self._transfer(data)
+
+    def stats(self):
+        with self._lock:
+            return {"spi_bytes": self.spi_bytes, "refreshes": self.refreshes, "transfers": len(self.transfers)}
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
+    def module_init(self, cleanup=False):
+        self.pins[self.PWR_PIN] = 1
+        return 0
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def module_exit(self, cleanup=False):
+        logger.debug("close 5V, Module enters 0 power consumption ...")
+        self.pins[self.RST_PIN] = 0
+        self.pins[self.DC_PIN] = 0
+        self.pins[self.PWR_PIN] = 0
+
+
+def _is_raspberry_pi():
+    # Same check as `cat /proc/cpuinfo | grep Raspberry`, without the shell
+    for path in ('/proc/cpuinfo', '/proc/device-tree/model'):
+        try:
+            with open(path, 'rb') as f:
+                if b'Raspberry' in f.read():
+                    return True
+        except OSError:
+            pass
+    return False
+
+
+# The hardware backend is probed and opened on first use (e.g. when EPD() reads
+# the pin numbers), not when this module is imported
+_implementation = None
+_implementation_lock = threading.Lock()
+
+
+def _load_implementation():
+    global _implementation
+
+    with _implementation_lock:
+        if _implementation is None:
+            if os.environ.get('CREATEDAT_HARDWARE', '').lower() == 'sim':
+                implementation = Simulated()
+            elif _is_raspberry_pi():
+                implementation = RaspberryPi()
+            elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+                implementation = SunriseX3()
+            else:
+                implementation = JetsonNano()
+
+            module = sys.modules[__name__]
+            module.implementation = implementation
+            for func in [x for x in dir(implementation) if not x.startswith('_')]:
+                setattr(module, func, getattr(implementation, func))
+            _implementation = implementation
+    return _implementation
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    implementation = _load_implementation()
+    if name == 'implementation':
+        return implementation
+    try:
+        return getattr(implementation, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
 
 ### END OF FILE ###
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Vectorized port of noise2() from the `noise` package (_perlin.c).
+# Every step is done in float32 with the same operation order as the C code,
+# so the sign of each sample matches pnoise2() with the default arguments
+# (octaves=1, repeatx=repeaty=1024, base=0).
+
+_P = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225,
+    140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148,
+    247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32,
+    57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175,
+    74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122,
+    60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54,
+    65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169,
+    200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64,
+    52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212,
+    207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213,
+    119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
+    129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104,
+    218, 246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241,
+    81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157,
+    184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93,
+    222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180,
+], dtype=np.intp)
+
+PERM = np.concatenate([_P, _P])
+
+# x/y components of GRAD3 in _noise.h
+GRAD2 = np.array([
+    [1, 1], [-1, 1], [1, -1], [-1, -1],
+    [1, 0], [-1, 0], [1, 0], [-1, 0],
+    [0, 1], [0, -1], [0, 1], [0, -1],
+    [1, 0], [-1, 0], [0, -1], [0, 1],
+], dtype=np.float32)
+
+
+def _fade(t):
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+
+def _lerp(t, a, b):
+    return a + t * (b - a)
+
+
+def _grad(hash_, x, y):
+    h = hash_ & 15
+    return x * GRAD2[h, 0] + y * GRAD2[h, 1]
+
+
+def pnoise2(x, y, repeatx=1024, repeaty=1024, base=0):
+    """Evaluate 2D Perlin noise for whole arrays of coordinates at once.
+
+    Inputs are rounded to float32 the same way the C extension does when it
+    parses its float arguments. Returns a float32 array.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    repeatx = np.float32(repeatx)
+    repeaty = np.float32(repeaty)
+
+    i = np.floor(np.fmod(x, repeatx)).astype(np.intp)
+    j = np.floor(np.fmod(y, repeaty)).astype(np.intp)
+    ii = np.fmod((i + 1).astype(np.float32), repeatx).astype(np.intp)
+    jj = np.fmod((j + 1).astype(np.float32), repeaty).astype(np.intp)
+    i = (i & 255) + base
+    j = (j & 255) + base
+    ii = (ii & 255) + base
+    jj = (jj & 255) + base
+
+    x = x - np.floor(x)
+    y = y - np.floor(y)
+    fx = _fade(x)
+    fy = _fade(y)
+
+    A = PERM[i]
+    AA = PERM[A + j]
+    AB = PERM[A + jj]
+    B = PERM[ii]
+    BA = PERM[B + j]
+    BB = PERM[B + jj]
+
+    return _lerp(fy, _lerp(fx, _grad(PERM[AA], x, y),
+                               _grad(PERM[BA], x - 1, y)),
+                     _lerp(fx, _grad(PERM[AB], x, y - 1),
+                               _grad(PERM[BB], x - 1, y - 1)))
+
+
+def base_bits(base_buffer, total_bits):
+    """Unpack `base_buffer` to exactly `total_bits` bits, repeating it if short."""
+    bits = np.unpackbits(np.frombuffer(bytes(base_buffer), dtype=np.uint8))
+
+    if len(bits) < total_bits:
+        return np.resize(bits, total_bits)
+    return bits[:total_bits]
+
+
+def window_values(bits, index):
+    """Value of the 8 bits starting at each position in `index` (MSB first).
+
+    Windows running past the end of `bits` are zero-padded on the right.
+    """
+    padded = np.concatenate([bits.astype(np.intp), np.zeros(8, dtype=np.intp)])
+    values = np.zeros(index.shape, dtype=np.intp)
+    for k in range(8):
+        values = (values << 1) | padded[index + k]
+    return values
+
+
+def threshold_rows(bits, width, y_start, y_end, ns, nsX, nsY):
+    """Packed 1-bpp rows y_start..y_end-1 of the Perlin frame for `bits`.
+
+    Each pixel samples the 8 bits starting at x + x * y of the base frame,
+    offsets its noise coordinates by that value and is set where the noise
+    is positive. Returns a uint8 array of shape (rows, ceil(width / 8)).
+    """
+    xs = np.arange(width)
+    ys = np.arange(y_start, y_end)[:, np.newaxis]
+    byte_val = window_values(bits, xs * (ys + 1))
+
+    nx = xs * ns + byte_val * nsX
+    ny = ys * ns + byte_val * nsY
+
+    return np.packbits(pnoise2(nx, ny) > 0, axis=1)
@@ -1,6 +1,11 @@
+import boottime
+
+import argparse
 import logging
+import os
+import signal
+import threading
 import time
-import math
 #import geocoder
 from enum import Enum
 from gpiozero import Button
@@ -8,7 +13,9 @@ from signal import pause
 
 import led
 import epaper
+import simulate
 from gps import DEFAULT_LATITUDE, DEFAULT_LONGITUDE
+from render import make_seeds, block_size_for, is_tenths_even
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,6 +24,25 @@ logging.basicConfig(
 
 logger = logging.getLogger("main")
 
+parser = argparse.ArgumentParser(description="createdAt")
+parser.add_argument(
+    "--profile-boot",
+    nargs="?",
+    const="boot_timeline.json",
+    metavar="PATH",
+    help="write a JSON timeline of the boot phases to PATH (default: boot_timeline.json)"
+)
+args, _ = parser.parse_known_args()
+
+if args.profile_boot:
+    boottime.enable_profile(args.profile_boot)
+
+if simulate.enabled():
+    logger.info("running on simulated hardware")
+    simulate.use_mock_pins()
+
+boottime.mark("imports")
+
 class Mode(Enum):
     IDLE = 0
     ACTIVE = 1
@@ -26,10 +52,6 @@ mode = Mode.IDLE
 button_press_time = None
 sevenseg = None
 
-def make_number(value):
-    frac = value - math.floor(value)
-    return 0.01 + frac * 0.09
-
 def init():
     global mode, button_press_time, sevenseg
     
@@ -54,7 +76,8 @@ def on_button_press():
     global button_press_time, mode
     if button_press_time is None:
         return
-    press_duration = time.time() - button_press_time
+    pressed_at = button_press_time
+    press_duration = time.time() - pressed_at
     logger.info(f"Button released - {press_duration:.3f}")
     
     button_press_time = None
@@ -63,25 +86,32 @@ def on_button_press():
         logger.debug("Ignoring very short press {press_duration}")
         return
 
-    toggle(press_duration)
+    toggle(press_duration, pressed_at)
 
 def on_button_release():
     global button_press_time
     button_press_time = time.time()
     logger.debug("Button pressed")
 
-def is_tenths_even(x: float) -> bool:
-    tenths = int(abs(x) * 10)%10
-    return tenths % 2 == 0
+    # The frame only depends on location, press time and press duration, so
+    # start rendering the likely candidates while the button is still held
+    if mode == Mode.IDLE and sevenseg is not None:
+        lat, lng, _ = sevenseg.gps.get_stable_location()
+        _, _, ns, nsX, nsY = make_seeds(lat, lng)
+        epaper.prerender(ns, nsX, nsY, t=button_press_time)
 
-def toggle(press_duration):
+def toggle(press_duration, pressed_at=None):
     global mode
 
+    if pressed_at is None:
+        pressed_at = time.time()
+
     if mode == Mode.IDLE:
         mode = Mode.ACTIVE
         logger.info(f"Switch to ACTIVE - {press_duration:.3f}")
         sevenseg.set_mode(mode)
-        sevenseg.freeze()
+        # Show the same second the artwork is seeded with
+        sevenseg.freeze(int(pressed_at))
 
         # geocoder ---
         #g = geocoder.ip('me')
@@ -91,25 +121,19 @@ def toggle(press_duration):
         #lat = DEFAULT_LATITUDE
         #lng = DEFAULT_LONGITUDE
 
-        lat, lng, _ = sevenseg.gps.get_location()
+        lat, lng, _ = sevenseg.gps.get_stable_location()
 
         logger.info(f"Location: {lat} {lng}")
-        seed = abs(lat * 100 + lng * 100)
+        seed, hash_mode, ns, nsX, nsY = make_seeds(lat, lng)
         # -----
-        block_size = int(press_duration)
-        if block_size < 1:
-            block_size = 1
+        block_size = block_size_for(press_duration)
         # -----
-        hash_mode = int(seed% 11) 
         logger.info(f"Hash Mode: {hash_mode}")
         # -----
         is_perlin = is_tenths_even(press_duration)
         logger.info(f"is Perlin - value: {seed}")
         logger.info(f"is Perlin: {is_perlin}")
         # -----
-        ns = make_number(lat+lng)
-        nsX = make_number(lat)
-        nsY = make_number(lng)
         logger.info(f"noiseSize, noiseSizeX, noiseSizeY: {ns}, {nsX}, {nsY}")
         # -----
 
@@ -119,7 +143,8 @@ def toggle(press_duration):
                 is_perlin,
                 ns,
                 nsX,
-                nsY 
+                nsY,
+                t=pressed_at
         )
     else:
         mode = Mode.IDLE
@@ -129,15 +154,32 @@ def toggle(press_duration):
         epaper.clear()
         sevenseg.unfreeze()
 
+def sim_report():
+    from lib import epdconfig
+
+    logger.info(f"panel timings: {epaper.panel_timings()}")
+    logger.info(f"queue: {epaper.queue_stats()}")
+    logger.info(f"panel SPI: {epdconfig.implementation.stats()}")
+    # Wake pause() in the main thread and shut down as on Ctrl+C
+    signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+
 # --- init, boost ---
 try:
+    # Fork the render workers before the LED/GPS threads exist
+    epaper.start_render_pool()
+    boottime.mark("render pool")
+
     sevenseg = led.SevenSeg()
+    boottime.mark("SevenSeg")
 
     time.sleep(0.3)
+    boottime.mark("settle sleep 1")
 
     init()
+    boottime.mark("epaper init/clear")
 
     time.sleep(0.3)
+    boottime.mark("settle sleep 2")
 
     # toggle button 
     button = Button(
@@ -157,8 +199,24 @@ try:
     )
     
     reset_button.when_pressed = on_reset_pressed
+    boottime.mark("buttons armed")
 
     logger.info("System ready")
+    boottime.summary()
+
+    # numpy & co. are imported lazily; load them now, off the boot path
+    threading.Thread(target=epaper.preload, daemon=True).start()
+
+    # e.g. CREATEDAT_SIM_PRESSES=1.2,0.4,3.0: press the toggle button for
+    # these durations, report timings and exit
+    sim_presses = os.environ.get("CREATEDAT_SIM_PRESSES")
+    if simulate.enabled() and sim_presses:
+        simulate.drive_presses(
+            button,
+            [float(d) for d in sim_presses.split(",")],
+            idle=lambda: epaper.queue_stats()["depth"] == 0,
+            done=sim_report,
+        )
 
     pause()
 
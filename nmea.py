@@ -0,0 +1,153 @@
+import logging
+import time
+from functools import reduce
+from operator import xor
+
+logger = logging.getLogger("nmea")
+
+# Longest line kept while waiting for its end; NMEA 0183 allows 82 characters
+MAX_SENTENCE = 128
+# Sentence types that are checksummed and handed out; the rest are skipped unread
+PARSED_TYPES = (b"GGA", b"RMC", b"GSA")
+
+
+class Sentence:
+    __slots__ = ("talker", "kind", "body", "_fields")
+
+    def __init__(self, body):
+        """
+        One checksum-valid sentence. Fields are split on first access.
+
+        :param body: bytes between "$" and "*", e.g. b"GNGGA,123519,..."
+        """
+        self.body = body
+        self.talker = body[:2]
+        self.kind = body[2:5]
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = self.body.split(b",")
+        return self._fields
+
+    def field(self, index):
+        """Field `index` as bytes (0 is the address, e.g. b"GNGGA"); b"" if absent."""
+        fields = self.fields
+        return fields[index] if index < len(fields) else b""
+
+    def number(self, index, kind=float):
+        """Field `index` converted with `kind`, or None if empty or malformed."""
+        value = self.field(index)
+        if not value:
+            return None
+        try:
+            return kind(value)
+        except ValueError:
+            return None
+
+
+def coordinate(value, hemisphere):
+    """Degrees from an NMEA (D)DDMM.MMMM field and its N/S/E/W field, or None."""
+    dot = value.find(b".")
+    if dot < 0:
+        dot = len(value)
+    if dot < 3:
+        return None
+    try:
+        degrees = float(value[:dot - 2]) + float(value[dot - 2:]) / 60.0
+    except ValueError:
+        return None
+    return -degrees if hemisphere in (b"S", b"W") else degrees
+
+
+class NmeaParser:
+    def __init__(self, types=PARSED_TYPES):
+        """
+        Incremental NMEA 0183 parser for a byte stream.
+
+        :param types: sentence types (e.g. b"GGA") to validate and return
+        """
+        self.types = types
+        self._buffer = bytearray()
+        self.stats = {"sentences": 0, "parsed": 0, "bad_checksum": 0, "malformed": 0, "overflow": 0}
+
+    def feed(self, data):
+        """
+        Add received bytes.
+
+        :return: list of complete, checksum-valid Sentences of the wanted types
+        """
+        buf = self._buffer
+        buf += data
+        sentences = []
+
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            sentence = self._sentence(buf, start, end)
+            if sentence is not None:
+                sentences.append(sentence)
+            start = end + 1
+
+        if start:
+            del buf[:start]
+        if len(buf) > MAX_SENTENCE:
+            # No line end in sight: noise or a wrong baud rate
+            self.stats["overflow"] += 1
+            buf.clear()
+        return sentences
+
+    def _sentence(self, buf, start, end):
+        dollar = buf.find(b"$", start, end)
+        if dollar < 0:
+            if buf[start:end].strip():
+                self.stats["malformed"] += 1
+            return None
+
+        self.stats["sentences"] += 1
+        if buf[dollar + 3:dollar + 6] not in self.types:
+            return None
+
+        star = buf.rfind(b"*", dollar, end)
+        if star < 0 or end - star < 3:
+            self.stats["malformed"] += 1
+            return None
+
+        body = bytes(buf[dollar + 1:star])
+        try:
+            expected = int(buf[star + 1:star + 3], 16)
+        except ValueError:
+            self.stats["malformed"] += 1
+            return None
+        if reduce(xor, body, 0) != expected:
+            self.stats["bad_checksum"] += 1
+            return None
+
+        self.stats["parsed"] += 1
+        return Sentence(body)
+
+
+class RateLimit:
+    def __init__(self, interval):
+        """
+        Lets one event through per `interval` seconds and counts the rest.
+
+        :param interval: seconds between events that get through
+        """
+        self.interval = interval
+        self._next = 0.0
+        self._suppressed = 0
+
+    def __call__(self):
+        """None if this event should be dropped, else how many were dropped before it."""
+        now = time.monotonic()
+        if now < self._next:
+            self._suppressed += 1
+            return None
+        self._next = now + self.interval
+        suppressed = self._suppressed
+        self._suppressed = 0
+        return suppressed
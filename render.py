@@ -0,0 +1,217 @@
+import logging
+import math
+import os
+import threading
+import hashlib
+from collections import OrderedDict
+
+logger = logging.getLogger("render")
+
+
+def make_number(value):
+    frac = value - math.floor(value)
+    return 0.01 + frac * 0.09
+
+
+def make_seeds(lat, lng):
+    """Seeds for a location: (seed, hash_mode, ns, nsX, nsY)."""
+    seed = abs(lat * 100 + lng * 100)
+    hash_mode = int(seed % 11)
+    ns = make_number(lat + lng)
+    nsX = make_number(lat)
+    nsY = make_number(lng)
+    return seed, hash_mode, ns, nsX, nsY
+
+
+def block_size_for(press_duration):
+    return max(1, int(press_duration))
+
+
+def is_tenths_even(x: float) -> bool:
+    tenths = int(abs(x) * 10) % 10
+    return tenths % 2 == 0
+
+
+class RenderCancelled(Exception):
+    """Raised between render stages when the caller's `cancelled()` says so."""
+
+
+def frame_key(hash_mode, block_size, is_perlin, ns, nsX, nsY, t):
+    """
+    Cache key for a black frame.
+
+    Only the part of the timestamp that reaches the hash is kept: hash_mode 0
+    uses bin(int(t)), every other mode hashes str(t).
+    """
+    seed = int(t) if hash_mode == 0 else str(t)
+    if not is_perlin:
+        ns = nsX = nsY = None
+    return (hash_mode, block_size, bool(is_perlin), ns, nsX, nsY, seed)
+
+
+class RenderCache:
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_entries=256):
+        """
+        Bounded cache of packed 1-bpp black frames.
+
+        :param max_entries: number of frames kept in memory (LRU)
+        :param cache_dir: optional directory for an on-disk copy of each frame
+        :param max_disk_entries: number of frames kept in cache_dir
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._frames = OrderedDict()
+        self._rendering = {}
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, name + ".bin")
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+
+        if frame is None and self.cache_dir:
+            try:
+                with open(self._path(key), "rb") as f:
+                    frame = f.read()
+                self._remember(key, frame)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"render cache read failed: {e}")
+
+        with self._lock:
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if frame is None:
+            return None
+        return bytearray(frame)
+
+    def claim(self, key):
+        """
+        Mark `key` as being rendered.
+
+        Returns None if the caller now owns the render, or an Event that is
+        set once the thread already rendering `key` is done with it.
+        """
+        with self._lock:
+            event = self._rendering.get(key)
+            if event is None:
+                self._rendering[key] = threading.Event()
+            return event
+
+    def release(self, key):
+        with self._lock:
+            event = self._rendering.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def put(self, key, frame):
+        frame = bytes(frame)
+        self._remember(key, frame)
+
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(frame)
+                os.replace(tmp, path)
+                self._prune_disk()
+            except OSError as e:
+                logger.warning(f"render cache write failed: {e}")
+
+    def _remember(self, key, frame):
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_entries:
+                self._frames.popitem(last=False)
+
+    def _prune_disk(self):
+        entries = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.endswith(".bin")
+        ]
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._frames)}
+
+
+def render_black(epd, hash_mode, block_size, is_perlin, ns, nsX, nsY, t, cache=None, pool=None, cancelled=None):
+    """
+    Generate the black frame for a DRAW, going through `cache` when given.
+
+    The Perlin stage runs on `pool` (a render_pool.PerlinPool) when given.
+    `cancelled` is checked before each stage; RenderCancelled is raised if
+    it returns True.
+    Always returns a fresh bytearray, so callers can't alter a cached frame.
+    """
+    key = frame_key(hash_mode, block_size, is_perlin, ns, nsX, nsY, t)
+
+    if cache is None:
+        return bytearray(_generate(epd, hash_mode, block_size, is_perlin, ns, nsX, nsY, t, pool, cancelled))
+
+    while True:
+        frame = cache.get(key)
+        if frame is not None:
+            logger.info(f"render cache hit {cache.stats()}")
+            return frame
+
+        # Another thread (e.g. the pre-renderer) may already be on this frame
+        rendering = cache.claim(key)
+        if rendering is None:
+            break
+        rendering.wait()
+        _check(cancelled)
+
+    try:
+        bw = _generate(epd, hash_mode, block_size, is_perlin, ns, nsX, nsY, t, pool, cancelled)
+        cache.put(key, bw)
+    finally:
+        cache.release(key)
+
+    logger.info(f"render cache miss {cache.stats()}")
+    return bytearray(bw)
+
+
+def _check(cancelled):
+    if cancelled is not None and cancelled():
+        raise RenderCancelled()
+
+
+def _generate(epd, hash_mode, block_size, is_perlin, ns, nsX, nsY, t, pool, cancelled):
+    _check(cancelled)
+    bw = epd.generatebuffer_time(hash_mode, block_size, t)
+    if is_perlin:
+        _check(cancelled)
+        if pool is not None:
+            bw = pool.generatebuffer_perlin(epd, bw, ns, nsX, nsY)
+        else:
+            bw = epd.generatebuffer_perlin(bw, ns, nsX, nsY)
+    return bw
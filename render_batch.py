@@ -0,0 +1,204 @@
+import os
+
+# Rendering needs no hardware; never open the real panel pins
+os.environ["CREATEDAT_HARDWARE"] = "sim"
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import sys
+import time
+
+import epaper
+import render
+
+logger = logging.getLogger("render_batch")
+
+# Seconds between progress lines
+PROGRESS_EVERY = 2.0
+
+_INVERT = bytes(255 - i for i in range(256))
+
+_epd = None
+
+
+def parse_values(spec):
+    """
+    Values from "a,b,c" or an inclusive range "start:stop:step"
+    (e.g. "35.6:35.8:0.05").
+    """
+    if ":" in spec:
+        start, stop, step = (float(v) for v in spec.split(":"))
+        if step <= 0:
+            raise argparse.ArgumentTypeError(f"step must be positive: {spec}")
+        count = int((stop - start) / step + 1e-9) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(v) for v in spec.split(",") if v]
+
+
+def load_spec(path):
+    """Sweep from a JSON file with "lat", "lon", "durations" and "timestamps" (strings as on the command line, or lists)."""
+    with open(path) as f:
+        raw = json.load(f)
+    spec = {}
+    for key in ("lat", "lon", "durations", "timestamps"):
+        if key in raw:
+            value = raw[key]
+            spec[key] = parse_values(value) if isinstance(value, str) else [float(v) for v in value]
+    return spec
+
+
+def frame_name(index, lat, lon, duration, t):
+    return f"{index:05d}_lat{lat:.6f}_lon{lon:.6f}_d{duration:.2f}_t{t:.3f}"
+
+
+def press_params(lat, lon, duration, t):
+    """DRAW params for a press, built as main.toggle() and epaper.draw_async() build them."""
+    _, _, ns, nsX, nsY = render.make_seeds(lat, lon)
+    return epaper.make_params(
+        render.block_size_for(duration),
+        render.is_tenths_even(duration),
+        ns,
+        nsX,
+        nsY,
+        t
+    )
+
+
+def render_press(epd, lat, lon, duration, t):
+    """The black frame the panel would show for a press; returns (frame, params)."""
+    params = press_params(lat, lon, duration, t)
+    bw = epaper.render_frame(epd, params, cache=None)
+    return bw, params
+
+
+def _init_worker():
+    global _epd
+
+    from lib.epd7in5b_V2 import EPD
+    _epd = EPD()
+
+
+def _render_job(job):
+    index, lat, lon, duration, t, out_dir, fmt = job
+
+    start = time.perf_counter()
+    bw, params = render_press(_epd, lat, lon, duration, t)
+    elapsed = time.perf_counter() - start
+
+    name = frame_name(index, lat, lon, duration, t)
+    path = None
+    if out_dir:
+        if fmt == "png":
+            path = os.path.join(out_dir, name + ".png")
+            _write_png(path, bw, _epd.width, _epd.height)
+        else:
+            path = os.path.join(out_dir, name + ".bin")
+            with open(path, "wb") as f:
+                f.write(bw)
+
+    return {
+        "index": index,
+        "lat": lat,
+        "lon": lon,
+        "duration": duration,
+        "t": t,
+        "hash_mode": epaper.RENDER_HASH_MODE,
+        "block_size": params["block_size"],
+        "is_perlin": params["is_perlin"],
+        "file": os.path.basename(path) if path else None,
+        "render_s": elapsed,
+    }
+
+
+def _write_png(path, frame, width, height):
+    from PIL import Image
+
+    # Frames are 1 = black; PIL's mode "1" is 0 = black
+    image = Image.frombytes("1", (width, height), bytes(frame).translate(_INVERT))
+    image.save(path, optimize=True)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s")
+
+    parser = argparse.ArgumentParser(
+        description="Render the frames visitors would see for a sweep of locations and press durations"
+    )
+    parser.add_argument("--spec", metavar="JSON", help="sweep file; command-line values override it")
+    parser.add_argument("--lat", type=parse_values, help='latitudes, "a,b,c" or "start:stop:step"')
+    parser.add_argument("--lon", type=parse_values, help='longitudes, "a,b,c" or "start:stop:step"')
+    parser.add_argument("--durations", type=parse_values, help="press durations in seconds (default 1.0)")
+    parser.add_argument("--timestamps", type=parse_values, help="press times, UNIX seconds (default: now)")
+    parser.add_argument("--out", default="frames", help="output directory (default: frames)")
+    parser.add_argument("--format", choices=("png", "bin"), default="png",
+                        help="png, or bin: raw packed 1-bpp frames (MSB first, 1 = black)")
+    parser.add_argument("--no-write", action="store_true", help="render only; for measuring throughput")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec) if args.spec else {}
+    for key in ("lat", "lon", "durations", "timestamps"):
+        value = getattr(args, key)
+        if value is not None:
+            spec[key] = value
+
+    from gps import DEFAULT_LATITUDE, DEFAULT_LONGITUDE
+    lats = spec.get("lat") or [DEFAULT_LATITUDE]
+    lons = spec.get("lon") or [DEFAULT_LONGITUDE]
+    durations = spec.get("durations") or [1.0]
+    timestamps = spec.get("timestamps") or [time.time()]
+
+    out_dir = None if args.no_write else args.out
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    jobs = [
+        (index, lat, lon, duration, t, out_dir, args.format)
+        for index, (lat, lon, duration, t) in enumerate(itertools.product(lats, lons, durations, timestamps))
+    ]
+    total = len(jobs)
+    logger.info(f"rendering {total} frames on {args.processes} processes")
+
+    results = []
+    ctx = multiprocessing.get_context("fork")
+    start = time.perf_counter()
+    next_report = start + PROGRESS_EVERY
+    with ctx.Pool(args.processes, initializer=_init_worker) as pool:
+        for result in pool.imap_unordered(_render_job, jobs):
+            results.append(result)
+            now = time.perf_counter()
+            if now >= next_report or len(results) == total:
+                done = len(results)
+                rate = done / (now - start)
+                eta = (total - done) / rate if rate else 0.0
+                logger.info(f"{done}/{total} frames, {rate:.2f} frames/s, ETA {eta:.0f}s")
+                next_report = now + PROGRESS_EVERY
+
+    wall = time.perf_counter() - start
+    results.sort(key=lambda r: r["index"])
+    render_total = sum(r["render_s"] for r in results)
+
+    summary = {
+        "frames": total,
+        "processes": args.processes,
+        "wall_s": wall,
+        "frames_per_s": total / wall if wall else 0.0,
+        "render_s_per_frame": render_total / total if total else 0.0,
+    }
+    logger.info(
+        f"{total} frames in {wall:.2f}s: {summary['frames_per_s']:.2f} frames/s "
+        f"({summary['render_s_per_frame'] * 1000:.1f} ms render per frame)"
+    )
+
+    if out_dir:
+        with open(os.path.join(out_dir, "index.json"), "w") as f:
+            json.dump({"summary": summary, "frames": results}, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
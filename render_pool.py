@@ -0,0 +1,132 @@
+import logging
+import mmap
+import multiprocessing
+import os
+import signal
+import threading
+
+from lib.epd7in5b_V2 import EPD_WIDTH, EPD_HEIGHT
+
+logger = logging.getLogger("render_pool")
+
+# Shared buffers, inherited by the forked workers
+_bits_mem = None
+_out_mem = None
+
+
+def _init_worker(bits_mem, out_mem):
+    global _bits_mem, _out_mem
+
+    # Ctrl+C is handled by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _bits_mem = bits_mem
+    _out_mem = out_mem
+
+
+def _preload(_):
+    import numpy
+    from lib import perlin
+    return os.getpid()
+
+
+def _render_band(width, height, y_start, y_end, ns, nsX, nsY):
+    import numpy as np
+    from lib import perlin
+
+    row_bytes = (width + 7) // 8
+    bits = np.frombuffer(_bits_mem, dtype=np.uint8, count=width * height)
+    out = np.frombuffer(_out_mem, dtype=np.uint8, count=row_bytes * height)
+
+    rows = perlin.threshold_rows(bits, width, y_start, y_end, ns, nsX, nsY)
+    out[y_start * row_bytes:y_end * row_bytes] = rows.ravel()
+    return y_end - y_start
+
+
+class PerlinPool:
+    def __init__(self, processes=None, width=EPD_WIDTH, height=EPD_HEIGHT, timeout=60.0):
+        """
+        Worker processes that render the Perlin stage in row bands.
+
+        The pool must be started before any other thread, since the workers
+        are forked. Base bits and the packed result are exchanged through
+        anonymous shared mappings, so only band bounds go over the pipes.
+
+        :param processes: number of workers (defaults to the CPU count)
+        :param width: frame width in pixels
+        :param height: frame height in pixels
+        :param timeout: seconds to wait for a frame before falling back
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._bits_mem = None
+        self._out_mem = None
+
+    def start(self):
+        if self._pool is not None:
+            return
+        try:
+            self._bits_mem = mmap.mmap(-1, self.width * self.height)
+            self._out_mem = mmap.mmap(-1, (self.width + 7) // 8 * self.height)
+            ctx = multiprocessing.get_context("fork")
+            self._pool = ctx.Pool(
+                self.processes,
+                initializer=_init_worker,
+                initargs=(self._bits_mem, self._out_mem),
+            )
+            logger.info(f"render pool started ({self.processes} processes)")
+        except Exception as e:
+            logger.warning(f"render pool unavailable, rendering in-process: {e}")
+            self._pool = None
+
+    def preload(self):
+        """Import numpy and the Perlin engine in every worker ahead of the first frame."""
+        with self._lock:
+            if self._pool is None:
+                return
+            try:
+                self._pool.map(_preload, range(self.processes), chunksize=1)
+            except Exception as e:
+                logger.warning(f"render pool preload failed: {e}")
+
+    def stop(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def generatebuffer_perlin(self, epd, base_buffer, ns, nsX, nsY):
+        """Drop-in for EPD.generatebuffer_perlin; same bytes, split across the pool."""
+        if self._pool is None or (epd.width, epd.height) != (self.width, self.height):
+            return epd.generatebuffer_perlin(base_buffer, ns, nsX, nsY)
+
+        import numpy as np
+        from lib import perlin
+
+        with self._lock:
+            try:
+                total_bits = self.width * self.height
+                bits = np.frombuffer(self._bits_mem, dtype=np.uint8, count=total_bits)
+                bits[:] = perlin.base_bits(base_buffer, total_bits)
+
+                edges = np.linspace(0, self.height, self.processes + 1).astype(int)
+                bands = [
+                    (self.width, self.height, int(y0), int(y1), ns, nsX, nsY)
+                    for y0, y1 in zip(edges[:-1], edges[1:])
+                    if y1 > y0
+                ]
+                self._pool.starmap_async(_render_band, bands).get(self.timeout)
+
+                return bytearray(self._out_mem[:len(self._out_mem)])
+            except Exception as e:
+                # Workers may still be busy with the failed job; don't reuse them
+                logger.warning(f"render pool failed, rendering in-process: {e}")
+                self._pool.terminate()
+                self._pool = None
+
+        return epd.generatebuffer_perlin(base_buffer, ns, nsX, nsY)
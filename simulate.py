@@ -0,0 +1,266 @@
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger("simulate")
+
+# CREATEDAT_HARDWARE=sim swaps every hardware backend for the fakes below (and
+# lib/epdconfig.Simulated for the e-paper), so main.py runs on any Linux box
+HARDWARE_ENV = "CREATEDAT_HARDWARE"
+
+# Where the fake GNSS receiver is, and how far (metres, 1 sigma) it wanders
+DEFAULT_SIM_LOCATION = (35.717420, 139.772949)
+DEFAULT_SIM_JITTER_M = 3.0
+# Seconds before the fake receiver reports a fix
+DEFAULT_SIM_FIX_AFTER = 5.0
+
+
+def enabled():
+    return os.environ.get(HARDWARE_ENV, "").lower() == "sim"
+
+
+def _location():
+    raw = os.environ.get("CREATEDAT_SIM_LOCATION")
+    if not raw:
+        return DEFAULT_SIM_LOCATION
+    lat, lon = (float(v) for v in raw.split(","))
+    return lat, lon
+
+
+def _env_float(name, default):
+    raw = os.environ.get(name)
+    return float(raw) if raw else default
+
+
+def use_mock_pins():
+    """Give gpiozero mock pins, so Buttons (and the gpiozero LED transport) work without GPIO."""
+    from gpiozero import Device
+    from gpiozero.pins.mock import MockFactory
+
+    Device.pin_factory = MockFactory()
+
+
+class Max7219Chain:
+    def __init__(self, modules=3, digits=8):
+        """
+        Fake MAX7219 daisy chain behind the led_transport interface. Words are
+        shifted through the modules like the real chain and latched on send().
+
+        :param modules: number of chained modules
+        :param digits: digits per module
+        """
+        self.modules = modules
+        self.digits = digits
+        # Module 0 is the one wired to the Pi
+        self._shift = [(0, 0)] * modules
+        self.registers = [dict() for _ in range(modules)]
+        self.frames = 0
+        self.bytes = 0
+        self.busy_s = 0.0
+
+    def send(self, data):
+        start = time.perf_counter()
+        data = bytes(data)
+        for i in range(0, len(data) - 1, 2):
+            self._shift = [(data[i], data[i + 1])] + self._shift[:-1]
+        for module, (reg, value) in enumerate(self._shift):
+            if reg:
+                self.registers[module][reg] = value
+        self.frames += 1
+        self.bytes += len(data)
+        self.busy_s += time.perf_counter() - start
+
+    def text(self, module):
+        """What `module` shows, leftmost digit first (Code-B decoded)."""
+        out = []
+        for reg in range(self.digits, 0, -1):
+            value = self.registers[module].get(reg, 0x0F)
+            code = value & 0x0F
+            out.append("0123456789-EHLP "[code])
+            if value & 0x80:
+                out.append(".")
+        return "".join(out)
+
+    def close(self):
+        logger.info(f"MAX7219 sim: {self.frames} frames, {self.bytes} bytes, shows {[self.text(m) for m in range(self.modules)]}")
+
+
+def _jittered(lat, lon, jitter_m):
+    if not jitter_m:
+        return lat, lon
+    dlat = random.gauss(0.0, jitter_m) / 111_320.0
+    dlon = random.gauss(0.0, jitter_m) / (111_320.0 * max(math.cos(math.radians(lat)), 1e-6))
+    return lat + dlat, lon + dlon
+
+
+class GnssI2C:
+    def __init__(self, bus=1):
+        """
+        Fake DFRobot TEL0157 register file behind the smbus2.SMBus calls that
+        gps.py makes. Reports CREATEDAT_SIM_LOCATION (with
+        CREATEDAT_SIM_JITTER_M of noise) once CREATEDAT_SIM_FIX_AFTER seconds
+        have passed.
+
+        :param bus: I2C bus number (ignored)
+        """
+        self.location = _location()
+        self.jitter_m = _env_float("CREATEDAT_SIM_JITTER_M", DEFAULT_SIM_JITTER_M)
+        self.fix_at = time.monotonic() + _env_float("CREATEDAT_SIM_FIX_AFTER", DEFAULT_SIM_FIX_AFTER)
+        self.writes = []
+        self.reads = 0
+
+    def write_byte_data(self, address, register, value):
+        self.writes.append((register, value))
+
+    def read_i2c_block_data(self, address, register, length):
+        self.reads += 1
+        regs = [0] * 23
+        t = time.gmtime()
+        regs[4:7] = [t.tm_hour, t.tm_min, t.tm_sec]
+
+        if time.monotonic() >= self.fix_at:
+            lat, lon = _jittered(*self.location, self.jitter_m)
+            for at, dir_at, value, positive, negative in ((7, 18, lat, "N", "S"), (13, 12, lon, "E", "W")):
+                deg, minutes = divmod(abs(value) * 60.0, 60.0)
+                frac = int(round((minutes - int(minutes)) * 100000))
+                regs[at] = int(deg)
+                regs[at + 1] = int(minutes)
+                regs[at + 2:at + 5] = [(frac >> 16) & 0xFF, (frac >> 8) & 0xFF, frac & 0xFF]
+                regs[dir_at] = ord(positive if value >= 0 else negative)
+        else:
+            # Searching: directions set, coordinates zero
+            regs[18] = ord("N")
+            regs[12] = ord("E")
+
+        return regs[register:register + length]
+
+    def close(self):
+        pass
+
+
+def _nmea(body):
+    checksum = 0
+    for ch in body.encode("ascii"):
+        checksum ^= ch
+    return f"${body}*{checksum:02X}\r\n".encode("ascii")
+
+
+def _nmea_coord(value, width):
+    deg, minutes = divmod(abs(value) * 60.0, 60.0)
+    return f"{int(deg):0{width}d}{minutes:08.5f}"
+
+
+class NmeaSerial:
+    def __init__(self, port="/dev/serial0", baudrate=115200, timeout=2):
+        """
+        Fake NMEA UART behind the pyserial calls that gps.py makes: once a
+        second it emits GGA, RMC and GSA sentences for CREATEDAT_SIM_LOCATION,
+        paced at `baudrate`.
+
+        :param port: serial port path (ignored)
+        :param baudrate: line rate used to pace the bytes
+        :param timeout: read timeout in seconds
+        """
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.location = _location()
+        self.jitter_m = _env_float("CREATEDAT_SIM_JITTER_M", DEFAULT_SIM_JITTER_M)
+        self.fix_at = time.monotonic() + _env_float("CREATEDAT_SIM_FIX_AFTER", DEFAULT_SIM_FIX_AFTER)
+
+        self._buffer = bytearray()
+        self._next_burst = time.monotonic()
+
+    def _burst(self):
+        t = time.gmtime()
+        hms = f"{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}.00"
+        if time.monotonic() < self.fix_at:
+            return (
+                _nmea(f"GNGGA,{hms},,,,,0,00,99.99,,,,,,")
+                + _nmea(f"GNRMC,{hms},V,,,,,,,,,,N")
+                + _nmea("GNGSA,A,1,,,,,,,,,,,,,99.99,99.99,99.99")
+            )
+
+        lat, lon = _jittered(*self.location, self.jitter_m)
+        ns = "N" if lat >= 0 else "S"
+        ew = "E" if lon >= 0 else "W"
+        lat_s = _nmea_coord(lat, 2)
+        lon_s = _nmea_coord(lon, 3)
+        date = f"{t.tm_mday:02d}{t.tm_mon:02d}{t.tm_year % 100:02d}"
+        return (
+            _nmea(f"GNGGA,{hms},{lat_s},{ns},{lon_s},{ew},1,12,0.80,40.0,M,39.0,M,,")
+            + _nmea(f"GNRMC,{hms},A,{lat_s},{ns},{lon_s},{ew},0.00,0.00,{date},,,A")
+            + _nmea("GNGSA,A,3,01,03,08,11,14,17,19,22,28,32,,,1.40,0.80,1.15")
+        )
+
+    def _fill(self, deadline):
+        while not self._buffer:
+            now = time.monotonic()
+            if now >= self._next_burst:
+                self._buffer += self._burst()
+                self._next_burst += 1.0
+                break
+            if now >= deadline:
+                return
+            time.sleep(min(self._next_burst, deadline) - now)
+
+    @property
+    def in_waiting(self):
+        if time.monotonic() >= self._next_burst:
+            self._buffer += self._burst()
+            self._next_burst += 1.0
+        return len(self._buffer)
+
+    def read(self, size=1):
+        self._fill(time.monotonic() + self.timeout)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        time.sleep(len(data) * 10 / self.baudrate)
+        return data
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        self._fill(deadline)
+        end = self._buffer.find(b"\n")
+        if end < 0:
+            end = len(self._buffer) - 1
+        data = bytes(self._buffer[:end + 1])
+        del self._buffer[:end + 1]
+        time.sleep(len(data) * 10 / self.baudrate)
+        return data
+
+    def close(self):
+        pass
+
+
+def drive_presses(button, durations, idle, gap=1.0, done=None):
+    """
+    Press `button` (a gpiozero Button on mock pins) for each of `durations`
+    seconds in turn, waiting for `idle()` and `gap` seconds before each.
+
+    The installation's button rests in gpiozero's "pressed" state (main.py
+    starts timing on when_released), so a visitor's press is a high pulse.
+    `done` is called once every press has been handled.
+    """
+    def run():
+        pin = button.pin
+        pin.drive_low()
+        for duration in durations:
+            time.sleep(gap)
+            while not idle():
+                time.sleep(0.1)
+            logger.info(f"simulated press {duration:.2f}s")
+            pin.drive_high()
+            time.sleep(duration)
+            pin.drive_low()
+        time.sleep(gap)
+        while not idle():
+            time.sleep(0.1)
+        if done is not None:
+            done()
+
+    thread = threading.Thread(target=run, name="sim-presses", daemon=True)
+    thread.start()
+    return thread
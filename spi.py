@@ -1,4 +1,11 @@
 import threading
 
+# Held only while bytes are being clocked out on SPI0 (e-paper, led_legacy).
+# The MAX7219 chain in led.py is bit-banged on its own GPIOs and never needs it.
 spi_lock = threading.Lock()
+
+# Set while the e-paper runs an init/clear/draw cycle
 epaper_busy = threading.Event()
+
+# Set while the panel itself is refreshing (waiting on BUSY); no bus is held
+panel_refreshing = threading.Event()